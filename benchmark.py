@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the retrieval of the data without querying the real datagrepper.
+
+A local server answers the queries on `/raw` with synthetic messages, at
+volumes similar to the ones seen on fedmsg, and the weekly run, the crawl
+of the contributors and a backfill over several years are timed against
+it. For each of them the wall time, the number of queries, the number of
+bytes transferred and the peak memory used are reported.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+from datetime import timedelta
+from multiprocessing import Process
+from multiprocessing import Queue
+
+import thisweekinfedora
+
+
+# Number of messages per week on each topic, as seen in November 2015
+WEEKLY_VOLUMES = {
+    'Updates to stable': 378,
+    'Updates to testing': 587,
+    'Builds': 15790,
+    'FAS user created': 135,
+    'Meeting started': 25,
+    'Meeting completed': 25,
+    'New packages': 39,
+    'Retired packages': 0,
+    'Posts on the planet': 90,
+    'Edit on the wiki': 760,
+    'Badges awarded': 620,
+    'Copr build started': 9015,
+    'Copr build completed': 8855,
+}
+# Number of distinct users sending messages on each topic
+USERS = 500
+
+
+class FakeDatagrepper(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Local server answering the queries on `/raw` the way datagrepper
+    does, with synthetic messages.
+
+    The messages of a topic are evenly spread in time according to its
+    weekly volume, so that any time period, however it is split, always
+    returns the same messages.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), fail_rate=0.0,
+                 latency=0.0):
+        """ Constructor.
+
+        :kwarg address: the address and port to listen on, a free port
+            is used by default.
+        :kwarg fail_rate: the proportion of queries answered with an
+            error 503, to exercise the retries.
+        :kwarg latency: the number of seconds to wait before answering
+            each query.
+
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeHandler)
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.rates = {}
+        for topic, volume in WEEKLY_VOLUMES.items():
+            self.rates[thisweekinfedora.TOPICS[topic]] = volume / 7.0
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        """ Return the url of `/raw` on this server. """
+        return 'http://{0}:{1}/raw'.format(*self.server_address)
+
+    def reset(self):
+        """ Reset the counters of queries and bytes sent. """
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def record(self, size):
+        """ Count one more query answered with `size` bytes. """
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+
+    def start(self):
+        """ Serve the queries from a background thread. """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answer the queries sent to the `FakeDatagrepper` server. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """ Do not log each query on stderr. """
+        pass
+
+    def _send(self, code, body):
+        """ Send the specified answer to the client. """
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.record(len(body))
+
+    def do_GET(self):
+        """ Answer a query on `/raw`. """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        url = urlparse.urlparse(self.path)
+        if url.path != '/raw':
+            self._send(404, json.dumps({'error': 'not found'}))
+            return
+        if random.random() < self.server.fail_rate:
+            self._send(503, 'Service Unavailable')
+            return
+
+        params = dict(urlparse.parse_qsl(url.query))
+        topic = params.get('topic')
+        start = float(params.get('start', 0))
+        end = float(params.get('end', time.time()))
+        rows_per_page = int(params.get('rows_per_page', 25))
+        page = int(params.get('page', 1))
+
+        # The messages of the topic are at regular intervals since the
+        # epoch, find the first and last ones of the time period
+        per_day = self.server.rates.get(topic, 0)
+        if per_day:
+            step = 86400.0 / per_day
+            first = int(math.ceil(start / step))
+            last = int(math.floor(end / step))
+            total = max(0, last - first + 1)
+        else:
+            step = first = total = 0
+
+        pages = int(math.ceil(total / float(rows_per_page)))
+        messages = []
+        index = first + (page - 1) * rows_per_page
+        while index < first + min(total, page * rows_per_page):
+            messages.append(make_message(topic, index, step))
+            index += 1
+
+        self._send(200, json.dumps({
+            'arguments': params,
+            'count': len(messages),
+            'pages': pages,
+            'total': total,
+            'raw_messages': messages,
+        }))
+
+
+def make_message(topic, index, step):
+    """ Return the synthetic message number `index` of a topic.
+
+    A few users send most of the messages, as on the real bus.
+
+    :arg topic: the fedmsg topic of the message.
+    :arg index: the number of the message since the epoch.
+    :arg step: the number of seconds between two messages of the topic.
+
+    """
+    rand = random.Random('{0}-{1}'.format(topic, index))
+    user = 'user{0}'.format(int(USERS * rand.random() ** 3))
+    return {
+        'i': 1,
+        'msg_id': '{0}-{1}'.format(topic, index),
+        'timestamp': index * step,
+        'topic': topic,
+        'username': 'apache',
+        'meta': {'usernames': [user, 'zodbot']},
+        'msg': {
+            'agent': user,
+            'owner': user,
+            'name': 'package{0}'.format(rand.randint(0, 20000)),
+            'version': '{0}.{1}'.format(
+                rand.randint(0, 9), rand.randint(0, 99)),
+            'release': '1.fc23',
+            'instance': 'primary',
+            'srpm': 'package-1.0-1.fc23.src.rpm',
+        },
+    }
+
+
+def _run_scenario(name, url, options, queue):
+    """ Run one scenario in the current process and put its wall and cpu
+    times and its peak memory in the queue.
+
+    :arg name: the name of the scenario to run.
+    :arg url: the url of the fake datagrepper.
+    :arg options: the parsed command line arguments.
+    :arg queue: the queue to put the results in.
+
+    """
+    workdir = tempfile.mkdtemp(prefix='twif-bench-')
+    os.makedirs(os.path.join(workdir, 'posts'))
+    os.makedirs(os.path.join(workdir, 'themes', 'thisweekinfedora',
+                             'assets'))
+    os.chdir(workdir)
+    # Keep the output of the script out of the report
+    sys.stdout = open(os.devnull, 'w')
+
+    thisweekinfedora.DATAGREPPER = url
+    if not options.cache:
+        thisweekinfedora.CACHE_DIR = None
+
+    date_to = thisweekinfedora.get_week_start()
+    start = time.time()
+    cpu = sum(os.times()[:4])
+    try:
+        if name == 'week':
+            thisweekinfedora.process_week(date_to)
+        elif name == 'contributors':
+            datetime_to, datetime_from = thisweekinfedora.get_week_bounds(
+                date_to)
+            thisweekinfedora.get_fedora_contributors(
+                datetime_to, datetime_from)
+        elif name == 'backfill':
+            thisweekinfedora.backfill(
+                date_to - timedelta(weeks=int(52 * options.years)), date_to,
+                workers=options.workers)
+    finally:
+        wall = time.time() - start
+        # Include the time of the processes started by backfill
+        cpu = sum(os.times()[:4]) - cpu
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    queue.put({'wall': wall, 'cpu': cpu, 'peak_rss_kb': rss})
+
+
+def run_scenario(server, name, options):
+    """ Run one scenario in a new process, so that its peak memory is
+    its own, and return its measures.
+
+    :arg server: the `FakeDatagrepper` server to query.
+    :arg name: the name of the scenario to run.
+    :arg options: the parsed command line arguments.
+
+    """
+    server.reset()
+    queue = Queue()
+    proc = Process(target=_run_scenario,
+                   args=(name, server.url, options, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode:
+        raise RuntimeError('Scenario {0} failed'.format(name))
+    results = queue.get()
+    results['scenario'] = name
+    results['requests'] = server.requests
+    results['bytes'] = server.bytes
+    return results
+
+
+def main():
+    """ Run the benchmarks specified on the command line and print their
+    results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        'scenarios', nargs='*', default=['week', 'contributors', 'backfill'],
+        choices=['week', 'contributors', 'backfill'],
+        help='The scenarios to run, all of them by default')
+    parser.add_argument(
+        '--years', type=float, default=2,
+        help='The number of years of the backfill')
+    parser.add_argument(
+        '--workers', type=int, default=5,
+        help='The number of weeks retrieved at the same time in backfill')
+    parser.add_argument(
+        '--fail-rate', type=float, default=0.0,
+        help='The proportion of queries answered with an error')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='The number of seconds to wait before answering a query')
+    parser.add_argument(
+        '--cache', action='store_true',
+        help='Use the cache of the answers of datagrepper')
+    parser.add_argument(
+        '--json', action='store_true',
+        help='Print the results as json')
+    options = parser.parse_args()
+
+    server = FakeDatagrepper(
+        fail_rate=options.fail_rate, latency=options.latency)
+    server.start()
+
+    try:
+        results = [run_scenario(server, name, options)
+                   for name in options.scenarios]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if options.json:
+        print json.dumps(results, indent=2, sort_keys=True)
+        return
+
+    print '{0} {1} {2} {3} {4} {5}'.format(
+        'Scenario'.ljust(14), 'Wall (s)'.rjust(10), 'CPU (s)'.rjust(10),
+        'Requests'.rjust(10), 'MB'.rjust(10), 'Peak RSS (MB)'.rjust(14))
+    for result in results:
+        print '{0} {1:10.2f} {2:10.2f} {3:10d} {4:10.1f} {5:14.1f}'.format(
+            result['scenario'].ljust(14), result['wall'], result['cpu'],
+            result['requests'], result['bytes'] / 1024. / 1024,
+            result['peak_rss_kb'] / 1024.)
+
+
+if __name__ == '__main__':
+    main()
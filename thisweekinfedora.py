@@ -8,17 +8,31 @@ This is the cron script querying the data of the past week and generating
 the corresponding blog entry.
 """
 
+import base64
 import calendar
+import contextlib
+import fcntl
+import gzip
+import hashlib
+import heapq
 import json
 import math
 import os
+import random
+import re
+import shutil
+import StringIO
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import zlib
 from datetime import datetime
 from datetime import timedelta
-from multiprocessing import Pool
 
-import pygal
-import requests
+# pygal, requests, multiprocessing and sqlite3 are imported by the
+# functions using them, so that the commands not needing them start fast
 
 
 DATAGREPPER = 'https://apps.fedoraproject.org/datagrepper/raw'
@@ -39,6 +53,123 @@ TOPICS = {
     'Copr build completed': 'org.fedoraproject.prod.copr.build.end',
 }
 BLACK_LIST_USERS = ['zodbot', 'bodhi']
+# Append-only log of the activities week after week, one json object per
+# line
+EVOLUTION_LOG = 'evolution.jsonl'
+# Former storage of the activities, imported in the log on first use
+EVOLUTION_FILE = 'evolution.txt'
+# Maximum number of weeks drawn in the evolution graph
+SVG_MAX_POINTS = 120
+# The evolution graph, an asset of the theme of the site
+EVOLUTION_SVG = os.path.join(
+    'themes', 'thisweekinfedora', 'assets', 'evolution.svg')
+# Append-only log of the most active users of each topic week after week
+CONTRIBUTORS_LOG = 'contributors.jsonl'
+# Number of users of each topic stored each week
+STORED_CONTRIBUTORS = 25
+# Folder in which the raw messages retrieved are archived, compressed,
+# per topic and week, None to not archive them
+ARCHIVE_DIR = None
+# SQLite database indexing the contributions of each user week after week,
+# local to the host and rebuilt from USERS_LOG when missing
+USER_INDEX = 'users.sqlite'
+# Append-only log of the contributions of every user week after week
+USERS_LOG = 'users.jsonl'
+# Number of users kept in the summaries of the most active users of each
+# topic, mergeable across weeks
+HEAVY_HITTERS_CAPACITY = 50
+# Number of bits of the hash of the users selecting the register of the
+# HyperLogLog sketches, they use 2 ** HLL_PRECISION registers for a
+# standard error of 1.04 / sqrt(2 ** HLL_PRECISION)
+HLL_PRECISION = 10
+# Folder in which the data retrieved by the `fetch` command is kept until
+# the `save` command stores it, and the data of the week in progress
+# retrieved day after day by the `ingest` command
+STAGING_DIR = 'staging'
+# Number of messages of each topic day after day
+DAILY_INDEX = 'daily.json'
+# Weeks already processed by a backfill, one json object per line
+BACKFILL_CHECKPOINT = 'backfill.jsonl'
+# Maximum number of queries sent to datagrepper at the same time
+CONCURRENCY = 5
+# Number of seconds to wait for datagrepper to answer a query
+REQUEST_TIMEOUT = 60
+# Number of times a failed query is sent again
+REQUEST_RETRIES = 5
+# Number of seconds to wait before sending a failed query again, doubled
+# at each new attempt
+REQUEST_BACKOFF = 1
+# Queries taking longer than this many seconds are considered a sign that
+# datagrepper is overloaded
+REQUEST_SLOW = 10
+# Number of seconds given to the weekly run to retrieve the data, the
+# topics not retrieved in time are left pending for a later run
+WEEK_BUDGET = 3600
+# Files in which the metrics of the weekly run are written, as json and
+# in the textfile format of prometheus, None to not write them
+METRICS_JSON = 'metrics.json'
+METRICS_PROM = 'metrics.prom'
+# Upper bounds, in seconds, of the buckets of the histogram of the time
+# taken by the queries
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Folder in which the profile of each stage of the run is written, the
+# run is not profiled if None
+PROFILE_DIR = None
+# Number of functions and of allocations listed per stage in the summary
+# of the profile
+PROFILE_TOP = 20
+# Split the time periods crawled in smaller ones rather than paging deep
+# into them
+SHARDED_CRAWL = True
+# Maximum number of messages per time period when splitting them
+SHARD_SIZE = 1000
+# Folder in which the answers of datagrepper for time periods that are
+# over are kept, set to None to bypass the cache entirely
+CACHE_DIR = 'cache'
+# Maximum size of the cache in bytes, the least recently used answers
+# are removed first
+CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Query datagrepper again even if the answer is in the cache (the cache
+# is then updated with the new answer)
+CACHE_REFRESH = False
+# Only time periods that ended this long ago are considered closed
+CACHE_DELAY = timedelta(hours=1)
+# The size of the cache is checked every this many writes
+CACHE_PRUNE_EVERY = 50
+# Content hashes of the sources of the site at the last publication
+PUBLISH_STATE = '.publish.json'
+# Sources from which nikola builds the site
+SITE_SOURCES = ['conf.py', 'posts', 'themes']
+
+_SESSION = None
+_SESSION_PID = None
+_CONTROLLER = None
+_CONTROLLER_PID = None
+_CACHE_LOCK = threading.Lock()
+_CACHE_WRITES = [0]
+
+
+def get_session():
+    """ Return the HTTP session shared by all the queries to datagrepper.
+
+    The session keeps its connections alive so that successive queries
+    re-use them instead of doing a new TLS handshake each time.
+    """
+    global _SESSION, _SESSION_PID
+    # The processes started by backfill must not write to the connections
+    # of their parent
+    if _SESSION is None or _SESSION_PID != os.getpid():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=CONCURRENCY)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _SESSION = session
+        _SESSION_PID = os.getpid()
+    return _SESSION
 
 
 def get_week_start():
@@ -50,7 +181,877 @@ def get_week_start():
     return week_start
 
 
-def query_datagrepper(start, end, topic, full=False):
+def check_deadline(deadline):
+    """ Raise an error if the deadline has passed.
+
+    :arg deadline: the time, as returned by `time.time`, after which no
+        more query is to be sent, None for no deadline.
+
+    """
+    if deadline is not None and time.time() > deadline:
+        raise RuntimeError('The time budget ran out')
+
+
+class RequestController(object):
+    """ Send the queries to datagrepper, retrying the ones failing and
+    adapting the number of queries sent at the same time to how well
+    datagrepper copes with them.
+
+    The number of queries allowed at the same time grows by one every
+    `limit` successful queries and is halved every time a query fails or
+    is slow (additive increase, multiplicative decrease). The processes
+    of a backfill each adapt their own limit, and share a semaphore
+    bounding the queries they send at the same time all together.
+    """
+
+    def __init__(self, max_limit=CONCURRENCY, timeout=REQUEST_TIMEOUT,
+                 retries=REQUEST_RETRIES, backoff=REQUEST_BACKOFF,
+                 slow=REQUEST_SLOW, shared=None):
+        """ Constructor.
+
+        :kwarg max_limit: the maximum number of queries sent at the same
+            time.
+        :kwarg timeout: the number of seconds to wait for an answer.
+        :kwarg retries: the number of times a failed query is sent again.
+        :kwarg backoff: the number of seconds to wait before the first
+            new attempt, doubled at each new attempt and randomized.
+        :kwarg slow: the number of seconds after which a query counts as
+            slow.
+        :kwarg shared: a `multiprocessing.Semaphore` acquired for each
+            query, shared with the controllers of other processes.
+
+        """
+        self.shared = shared
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.slow = slow
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        """ Wait until one more query is allowed. """
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+        if self.shared:
+            self.shared.acquire()
+
+    def _release(self, success, latency):
+        """ Record the outcome of a query and adapt the limit.
+
+        :arg success: a boolean specifying whether the query succeeded.
+        :arg latency: the number of seconds the query took.
+
+        """
+        if self.shared:
+            self.shared.release()
+        with self._condition:
+            self.in_flight -= 1
+            if success and latency < self.slow:
+                self.limit = min(
+                    self.max_limit, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(1.0, self.limit / 2)
+            self._condition.notify_all()
+
+    def get(self, url, params, deadline=None):
+        """ Query the specified url and return the decoded json answer.
+
+        Queries timing out, answered with a server error or returning
+        invalid json are sent again after an exponential and randomized
+        delay, the last error is raised if all the attempts fail.
+
+        :arg url: the url to query.
+        :arg params: the parameters of the query.
+        :kwarg deadline: the time, as returned by `time.time`, after which
+            the query is no longer sent nor sent again, the time waited
+            for the answer being shortened to end by then.
+
+        """
+        import requests
+
+        attempt = 0
+        while True:
+            check_deadline(deadline)
+            self._acquire()
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    # The deadline passed while waiting for the query to
+                    # be allowed
+                    if self.shared:
+                        self.shared.release()
+                    with self._condition:
+                        self.in_flight -= 1
+                        self._condition.notify_all()
+                    raise RuntimeError('The time budget ran out')
+            start = time.time()
+            req = None
+            try:
+                req = get_session().get(
+                    url, params=params, timeout=timeout)
+                if req.status_code == 429 or req.status_code >= 500:
+                    req.raise_for_status()
+                json_out = None
+                if req.status_code < 400:
+                    json_out = json.loads(req.text)
+            except (requests.RequestException, ValueError):
+                latency = time.time() - start
+                self._release(False, latency)
+                METRICS.record_request(
+                    params.get('topic'), latency,
+                    len(req.content) if req is not None else 0, error=True)
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                if deadline is not None and time.time() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            latency = time.time() - start
+            self._release(True, latency)
+            METRICS.record_request(
+                params.get('topic'), latency, len(req.content),
+                page='page' in params, error=req.status_code >= 400)
+            # Client errors will not get better by retrying
+            req.raise_for_status()
+            return json_out
+
+
+def _count_objects():
+    """ Return a dictionary giving the number of objects of each type
+    tracked by the garbage collector, for the allocations of a stage when
+    tracemalloc is not available.
+    """
+    import gc
+
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+class RunMetrics(object):
+    """ Metrics of one run: the queries sent to datagrepper per topic,
+    the time they took, the bytes received and the time spent in each
+    stage of the run.
+    """
+
+    def __init__(self, profile_dir=None):
+        """ Constructor.
+
+        :kwarg profile_dir: the folder in which to write the profile of
+            each stage, the stages are not profiled if None.
+
+        """
+        self.profile_dir = profile_dir
+        self.profiles = {}
+        self._stats = {}
+        self.started = time.time()
+        self.topics = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.bytes = 0
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _topic(self, topic):
+        """ Return the counters of the specified fedmsg topic, named
+        after the activity it corresponds to.
+        """
+        for name, fedmsg_topic in TOPICS.items():
+            if fedmsg_topic == topic:
+                topic = name
+                break
+        if topic not in self.topics:
+            self.topics[topic] = {
+                'requests': 0, 'pages': 0, 'errors': 0, 'cache_hits': 0}
+        return self.topics[topic]
+
+    def record_request(self, topic, latency, size, page=False,
+                       error=False):
+        """ Record one query sent to datagrepper.
+
+        :arg topic: the fedmsg topic queried.
+        :arg latency: the number of seconds the query took.
+        :arg size: the number of bytes received.
+        :kwarg page: a boolean specifying whether the query retrieved a
+            page of messages.
+        :kwarg error: a boolean specifying whether the query failed.
+
+        """
+        with self._lock:
+            counters = self._topic(topic)
+            counters['requests'] += 1
+            if error:
+                counters['errors'] += 1
+            elif page:
+                counters['pages'] += 1
+            self.bytes += size
+            self.latency_sum += latency
+            self.latency_count += 1
+            for idx, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.buckets[idx] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+    def record_cache_hit(self, topic):
+        """ Record one answer served from the cache.
+
+        :arg topic: the fedmsg topic queried.
+
+        """
+        with self._lock:
+            self._topic(topic)['cache_hits'] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Context manager recording the time spent in a stage of the
+        run, added to the time of the previous stages of the same name.
+
+        When profiling, the cpu time and the memory used by the stage are
+        recorded as well, with the profile of its calls.
+
+        :arg name: the name of the stage.
+
+        """
+        start = time.time()
+        profile = self._start_profile() if self.profile_dir else None
+        try:
+            yield
+        finally:
+            if profile:
+                self._stop_profile(name, profile)
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0) + \
+                    time.time() - start
+
+    def _start_profile(self):
+        """ Start profiling a stage and return what `_stop_profile` needs
+        to stop it.
+
+        The threads started during the stage, which retrieve the pages,
+        are profiled as well as the current one, until the stage ends.
+        The processes started by `backfill` are not profiled.
+        """
+        import cProfile
+        import resource
+        try:
+            import tracemalloc
+        except ImportError:
+            # Before Python 3.4 only the peak memory of the process is
+            # known, the allocations are counted per type of object
+            tracemalloc = None
+
+        profilers = [cProfile.Profile()]
+        profile = {
+            'profilers': profilers,
+            'stopped': False,
+            'tracemalloc': tracemalloc,
+            'tracing': False,
+            'objects': None,
+            'cpu': sum(os.times()[:2]),
+            'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+        def _profile_thread(frame, event, arg):
+            # Called on the first event of each new thread, the profiler
+            # enabled then replaces this function in the thread
+            profiler = cProfile.Profile()
+            profilers.append(profiler)
+            profiler.enable()
+
+            def _check_stopped(frame, event, arg):
+                # A profiler can only be disabled by its own thread, which
+                # does it on its first call after the end of the stage
+                if profile['stopped']:
+                    profiler.disable()
+                    sys.settrace(None)
+
+            sys.settrace(_check_stopped)
+
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            profile['tracing'] = True
+        elif not tracemalloc:
+            profile['objects'] = _count_objects()
+        threading.setprofile(_profile_thread)
+        profilers[0].enable()
+        return profile
+
+    def _stop_profile(self, name, profile):
+        """ Stop profiling a stage and record its profile, added to the
+        one of the previous stages of the same name.
+
+        :arg name: the name of the stage.
+        :arg profile: the profile returned by `_start_profile`.
+
+        """
+        import pstats
+        import resource
+
+        profile['profilers'][0].disable()
+        profile['stopped'] = True
+        threading.setprofile(None)
+        cpu = sum(os.times()[:2]) - profile['cpu']
+
+        tracemalloc = profile['tracemalloc']
+        allocations = []
+        if tracemalloc and tracemalloc.is_tracing():
+            peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            allocations = [
+                str(stat) for stat in tracemalloc.take_snapshot().statistics(
+                    'lineno')[:PROFILE_TOP]]
+            if profile['tracing']:
+                tracemalloc.stop()
+        else:
+            # Peak of the whole process so far, in kB on Linux
+            peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if profile['objects'] is not None:
+            before = profile['objects']
+            growth = sorted(
+                (count - before.get(type_name, 0), type_name)
+                for type_name, count in _count_objects().items()
+                if count > before.get(type_name, 0))
+            allocations = [
+                '{0}: +{1} objects'.format(type_name, count)
+                for count, type_name in reversed(growth[-PROFILE_TOP:])]
+
+        with self._lock:
+            stats = self._stats.get(name)
+            for profiler in profile['profilers']:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            self._stats[name] = stats
+
+            previous = self.profiles.get(name, {})
+            self.profiles[name] = {
+                'cpu': previous.get('cpu', 0) + cpu,
+                'peak_memory_kb': max(previous.get('peak_memory_kb', 0),
+                                      peak_kb),
+                'rss_growth_kb': previous.get('rss_growth_kb', 0) + max(
+                    0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    - profile['rss']),
+                'top_allocations': allocations or previous.get(
+                    'top_allocations', []),
+            }
+
+    def write_profiles(self, profile_dir=None):
+        """ Write the profile of each stage, readable with `pstats`, as
+        `<stage>.prof` and a summary of the time, the memory and the
+        functions taking the most time in each stage as `summary.txt`.
+
+        :kwarg profile_dir: the folder in which to write them, defaults
+            to the one the metrics were created with.
+
+        """
+        profile_dir = profile_dir or self.profile_dir
+        if not profile_dir or not self._stats:
+            return
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+        output = StringIO.StringIO()
+        with self._lock:
+            for name in sorted(self._stats):
+                stats = self._stats[name]
+                stats.dump_stats(
+                    os.path.join(profile_dir, '{0}.prof'.format(name)))
+                profile = self.profiles[name]
+                output.write(
+                    'Stage {0}: wall {1:.2f} s, cpu {2:.2f} s, peak memory '
+                    '{3:.1f} MB\n'.format(
+                        name, self.stages.get(name, 0), profile['cpu'],
+                        profile['peak_memory_kb'] / 1024.))
+                if profile['top_allocations']:
+                    output.write('\nTop allocations:\n')
+                    for allocation in profile['top_allocations']:
+                        output.write('    {0}\n'.format(allocation))
+                stats.stream = output
+                stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+                output.write('\n')
+
+        with open(os.path.join(profile_dir, 'summary.txt'), 'w') as stream:
+            stream.write(output.getvalue())
+
+    def to_dict(self):
+        """ Return the metrics as a json-serializable dictionary. """
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'topics': dict(
+                    (topic, dict(counters))
+                    for topic, counters in self.topics.items()),
+                'latency': {
+                    'buckets': dict(zip(
+                        [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                        self.buckets)),
+                    'sum': self.latency_sum,
+                    'count': self.latency_count,
+                },
+                'bytes': self.bytes,
+                'stages': dict(self.stages),
+                'profiles': dict(
+                    (name, dict(profile))
+                    for name, profile in self.profiles.items()),
+            }
+
+    def to_prometheus(self):
+        """ Return the metrics in the text format of prometheus. """
+        data = self.to_dict()
+        lines = []
+
+        def _metric(name, kind, doc, values):
+            lines.append('# HELP twif_{0} {1}'.format(name, doc))
+            lines.append('# TYPE twif_{0} {1}'.format(name, kind))
+            for labels, value in values:
+                lines.append('twif_{0}{1} {2}'.format(name, labels, value))
+
+        topics = sorted(data['topics'])
+        for key, doc in [
+                ('requests', 'Queries sent to datagrepper.'),
+                ('pages', 'Pages of messages retrieved.'),
+                ('errors', 'Queries which failed.'),
+                ('cache_hits', 'Answers served from the cache.')]:
+            _metric('{0}_total'.format(key), 'counter', doc, [
+                ('{{topic="{0}"}}'.format(topic), data['topics'][topic][key])
+                for topic in topics])
+        _metric('received_bytes_total', 'counter',
+                'Bytes received from datagrepper.', [('', data['bytes'])])
+
+        cumulated = 0
+        buckets = []
+        for idx, bound in enumerate(
+                [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']):
+            cumulated += self.buckets[idx]
+            buckets.append(('_bucket{{le="{0}"}}'.format(bound), cumulated))
+        lines.append('# HELP twif_request_duration_seconds '
+                     'Time taken by the queries to datagrepper.')
+        lines.append('# TYPE twif_request_duration_seconds histogram')
+        for labels, value in buckets + [
+                ('_sum', data['latency']['sum']),
+                ('_count', data['latency']['count'])]:
+            lines.append('twif_request_duration_seconds{0} {1}'.format(
+                labels, value))
+
+        _metric('stage_duration_seconds', 'gauge',
+                'Time spent in each stage of the run.', [
+                    ('{{stage="{0}"}}'.format(stage), data['stages'][stage])
+                    for stage in sorted(data['stages'])])
+        _metric('run_duration_seconds', 'gauge',
+                'Time taken by the run.', [('', data['duration'])])
+        _metric('last_run_timestamp_seconds', 'gauge',
+                'When the run started.', [('', data['started'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file=None, prom_file=None):
+        """ Write the metrics as json and in the textfile format of
+        prometheus, each file being replaced atomically.
+
+        :kwarg json_file: the path of the json file, not written if None.
+        :kwarg prom_file: the path of the prometheus file, not written if
+            None.
+
+        """
+        for file_name, content in [
+                (json_file, lambda: json.dumps(
+                    self.to_dict(), indent=2, sort_keys=True)),
+                (prom_file, self.to_prometheus)]:
+            if not file_name:
+                continue
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(file_name)),
+                suffix='.tmp')
+            with os.fdopen(fd, 'w') as stream:
+                stream.write(content())
+            os.chmod(tmp_path, 0644)
+            os.rename(tmp_path, file_name)
+
+
+METRICS = RunMetrics()
+
+
+def reset_metrics():
+    """ Start recording the metrics of a new run, profiling its stages if
+    PROFILE_DIR is set.
+    """
+    global METRICS
+    METRICS = RunMetrics(PROFILE_DIR)
+    return METRICS
+
+
+def get_controller():
+    """ Return the request controller shared by all the queries to
+    datagrepper.
+    """
+    global _CONTROLLER, _CONTROLLER_PID
+    # A process started by backfill may have been forked while a thread
+    # of its parent held the lock of the controller
+    if _CONTROLLER is None or _CONTROLLER_PID != os.getpid():
+        _CONTROLLER = RequestController()
+        _CONTROLLER_PID = os.getpid()
+    return _CONTROLLER
+
+
+def _cache_path(params):
+    """ Return the path of the file caching the answer of datagrepper
+    to the query with the provided parameters.
+
+    :arg params: the parameters of the query sent to datagrepper.
+
+    """
+    key = json.dumps([params['topic'], params['start'], params['end'],
+                      params.get('page'), params.get('rows_per_page')])
+    return os.path.join(
+        CACHE_DIR, '{0}.json.z'.format(hashlib.sha1(key).hexdigest()))
+
+
+def _cache_load(path):
+    """ Return the cached answer stored in the specified file or None if
+    there is none.
+
+    :arg path: the path of the file of the cache to read.
+
+    """
+    try:
+        with open(path, 'rb') as stream:
+            json_out = json.loads(zlib.decompress(stream.read()))
+    except (IOError, OSError, ValueError, zlib.error):
+        return None
+    # Mark the entry as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return json_out
+
+
+def _cache_store(path, json_out):
+    """ Store an answer of datagrepper in the cache.
+
+    The answer is written to a temporary file which is then renamed so
+    that several processes can share the cache without ever reading a
+    partial file.
+
+    :arg path: the path of the file of the cache to write.
+    :arg json_out: the decoded answer of datagrepper.
+
+    """
+    if not os.path.isdir(CACHE_DIR):
+        try:
+            os.makedirs(CACHE_DIR)
+        except OSError:
+            # Created in the meanwhile by another worker
+            pass
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(zlib.compress(json.dumps(json_out)))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    with _CACHE_LOCK:
+        _CACHE_WRITES[0] += 1
+        prune = _CACHE_WRITES[0] % CACHE_PRUNE_EVERY == 1
+    if prune:
+        prune_cache()
+
+
+def prune_cache(max_size=None):
+    """ Remove the least recently used answers from the cache until it
+    fits in the specified size.
+
+    :kwarg max_size: the maximum size of the cache in bytes, defaults to
+        CACHE_MAX_SIZE.
+
+    """
+    if max_size is None:
+        max_size = CACHE_MAX_SIZE
+    if not CACHE_DIR or not os.path.isdir(CACHE_DIR):
+        return
+
+    entries = []
+    total = 0
+    for filename in os.listdir(CACHE_DIR):
+        if not filename.endswith('.json.z'):
+            continue
+        path = os.path.join(CACHE_DIR, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another worker
+            pass
+        total -= size
+
+
+def _get_page(start, end, topic, page=None, rows_per_page=None,
+              deadline=None):
+    """ Retrieve one page of results from datagrepper and return the
+    decoded json.
+
+    :arg start: a datetime object specifying when the time period to
+        query started.
+    :arg end: a datetime object specifying when the time period to
+        query ended.
+    :arg topic: the fedmsg topic to query.
+    :kwarg page: the page to retrieve, only the count is of interest
+        if not specified.
+    :kwarg rows_per_page: the number of messages per page.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        datagrepper is no longer queried and an error is raised.
+
+    """
+    params = {'start': calendar.timegm(start.timetuple()),
+              'end': calendar.timegm(end.timetuple()),
+              'topic': topic,
+              'meta': 'usernames',
+              }
+    if page is not None:
+        params['page'] = page
+        params['rows_per_page'] = rows_per_page
+
+    # What happened in a time period that is over can no longer change
+    path = None
+    if CACHE_DIR and end < datetime.utcnow() - CACHE_DELAY:
+        path = _cache_path(params)
+        if not CACHE_REFRESH:
+            json_out = _cache_load(path)
+            if json_out is not None:
+                METRICS.record_cache_hit(topic)
+                return json_out
+
+    json_out = get_controller().get(DATAGREPPER, params, deadline=deadline)
+    if path:
+        _cache_store(path, json_out)
+    return json_out
+
+
+def split_time_period(start, end, topic, max_total=SHARD_SIZE,
+                      workers=CONCURRENCY, deadline=None):
+    """ Split the provided time period in consecutive time periods during
+    which at most `max_total` messages were sent on the topic.
+
+    The time period is first split in as many equal parts as its number
+    of messages requires, then the parts still having too many messages
+    are cut in two until they fit. Returns a list of (start, end, total)
+    tuples, the time periods without messages are left out.
+
+    :arg start: a datetime object specifying when the time period to
+        split started.
+    :arg end: a datetime object specifying when the time period to
+        split ended.
+    :arg topic: the fedmsg topic to query.
+    :kwarg max_total: the maximum number of messages per time period.
+    :kwarg workers: the number of time periods counted at the same time.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        datagrepper is no longer queried and an error is raised.
+
+    """
+    def _count(period):
+        return period + (_get_page(
+            period[0], period[1], topic, deadline=deadline)['total'],)
+
+    total = _count((start, end))[2]
+    parts = int(math.ceil(total / float(max_total)))
+    if parts <= 1:
+        return [(start, end, total)] if total else []
+
+    # Consecutive time periods share their bound, the messages sent at
+    # that second are retrieved twice and deduplicated afterward
+    seconds = int((end - start).total_seconds())
+    bounds = [start + timedelta(seconds=seconds * idx // parts)
+              for idx in range(parts)] + [end]
+    todo = zip(bounds[:-1], bounds[1:])
+
+    from multiprocessing.pool import ThreadPool
+
+    periods = []
+    pool = ThreadPool(max(1, min(workers, parts)))
+    try:
+        while todo:
+            next_todo = []
+            for period_start, period_end, period_total in pool.map(
+                    _count, todo):
+                length = (period_end - period_start).total_seconds()
+                if period_total <= max_total or length < 2:
+                    if period_total:
+                        periods.append(
+                            (period_start, period_end, period_total))
+                    continue
+                middle = period_start + timedelta(seconds=int(length) // 2)
+                next_todo.extend(
+                    [(period_start, middle), (middle, period_end)])
+            todo = next_todo
+    finally:
+        pool.close()
+        pool.join()
+
+    return sorted(periods)
+
+
+def iter_datagrepper_sharded(start, end, topic, workers=CONCURRENCY,
+                             deadline=None):
+    """ Iterate over all the messages sent on a topic during the provided
+    time period, yielding them in batches.
+
+    Instead of paging deep into the whole time period, it is split with
+    `split_time_period` in time periods of a few pages which are crawled
+    `workers` at a time, each batch being only retrieved once the
+    previous one has been consumed. The messages are deduplicated on their
+    `msg_id`, so a message at the bound of two time periods or moved from
+    one page to another by the arrival of new messages is only yielded
+    once.
+
+    :arg start: a datetime object specifying when the time period to
+        query started.
+    :arg end: a datetime object specifying when the time period to
+        query ended.
+    :arg topic: the fedmsg topic to query.
+    :kwarg workers: the number of time periods retrieved at the same time.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        datagrepper is no longer queried and an error is raised.
+
+    """
+    periods = split_time_period(
+        start, end, topic, workers=workers, deadline=deadline)
+
+    def _crawl(period):
+        messages = []
+        for page in iter_datagrepper(
+                period[0], period[1], topic, workers=1, sharded=False,
+                deadline=deadline):
+            messages.extend(page)
+        return messages
+
+    def _batches():
+        if len(periods) > 1 and workers > 1:
+            from multiprocessing.pool import ThreadPool
+
+            pool = ThreadPool(min(workers, len(periods)))
+            try:
+                for batch in range(0, len(periods), workers):
+                    # map returns the time periods in the order they
+                    # were asked
+                    for messages in pool.map(
+                            _crawl, periods[batch:batch + workers]):
+                        yield messages
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for period in periods:
+                yield _crawl(period)
+
+    # A message can only appear twice in the same time period or in two
+    # consecutive ones, so only the ids of these two are kept
+    previous = set()
+    for messages in _batches():
+        current = set()
+        unique = []
+        for msg in messages:
+            if msg['msg_id'] not in current \
+                    and msg['msg_id'] not in previous:
+                current.add(msg['msg_id'])
+                unique.append(msg)
+        previous = current
+        yield unique
+
+
+def iter_datagrepper(start, end, topic, workers=CONCURRENCY, sharded=None,
+                     deadline=None):
+    """ Iterate over all the messages sent on a topic during the provided
+    time period, yielding them page after page in order.
+
+    At most `workers` pages are retrieved at the same time and each batch
+    is only retrieved once the previous one has been consumed, so the
+    memory used does not depend on the number of messages.
+
+    :arg start: a datetime object specifying when the time period to
+        query started.
+    :arg end: a datetime object specifying when the time period to
+        query ended.
+    :arg topic: the fedmsg topic to query.
+    :kwarg workers: the number of pages retrieved at the same time, the
+        pages are retrieved one after the other if lower than 2.
+    :kwarg sharded: a boolean specifying whether to split the time period
+        using `iter_datagrepper_sharded` rather than paging through it,
+        defaults to SHARDED_CRAWL.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        datagrepper is no longer queried and an error is raised, so that
+        the threads crawling a topic left pending stop.
+
+    """
+    if sharded is None:
+        sharded = SHARDED_CRAWL
+    if sharded:
+        for messages in iter_datagrepper_sharded(
+                start, end, topic, workers=workers, deadline=deadline):
+            yield messages
+        return
+
+    # The first page tells us how many pages there are to retrieve
+    json_out = _get_page(start, end, topic, page=1, rows_per_page=100,
+                         deadline=deadline)
+    pages = int(json_out['pages'])
+    yield json_out['raw_messages']
+    del json_out
+
+    def _query(cnt):
+        json_out = _get_page(start, end, topic, page=cnt, rows_per_page=100,
+                             deadline=deadline)
+        info = '{0} - page: {1}/{2}\r'.format(topic, cnt, pages)
+        sys.stdout.write(info)
+        sys.stdout.flush()
+        return json_out['raw_messages']
+
+    if pages < 2:
+        return
+
+    if workers > 1:
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(workers, pages - 1))
+        try:
+            for batch in range(2, pages + 1, workers):
+                # map returns the pages in the order they were asked
+                for messages in pool.map(
+                        _query, range(batch, min(batch + workers, pages + 1))):
+                    yield messages
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for cnt in range(2, pages + 1):
+            yield _query(cnt)
+
+
+def query_datagrepper(start, end, topic, full=False, workers=CONCURRENCY):
     """ Query datagrepper for the provided time period and topic and
     returns the number of events that occured then.
 
@@ -61,46 +1062,74 @@ def query_datagrepper(start, end, topic, full=False):
     :arg topic: the fedmsg topic to query.
     :kwarg full: a boolean specifying whether to retrieve all the
         messages or not.
+    :kwarg workers: the number of pages retrieved at the same time when
+        retrieving all the messages, the pages are retrieved one after
+        the other if lower than 2.
 
     """
     if not full:
-        params = {'start': calendar.timegm(start.timetuple()),
-                  'end': calendar.timegm(end.timetuple()),
-                  'topic': topic,
-                  'meta': 'usernames',
-                  }
-        req = requests.get(DATAGREPPER, params=params)
-        json_out = json.loads(req.text)
+        json_out = _get_page(start, end, topic)
         info = '{0}\r'.format(topic)
         sys.stdout.write(info)
         sys.stdout.flush()
         json_out = json_out['total']
     else:
-        messages = []
-        cnt = 1
-        while True:
-            params = {
-                'start': calendar.timegm(start.timetuple()),
-                'end': calendar.timegm(end.timetuple()),
-                'rows_per_page': 100,
-                'page': cnt,
-                'topic': topic,
-                'meta': 'usernames',
-            }
-            req = requests.get(DATAGREPPER, params=params)
-            json_out = json.loads(req.text)
-            info = '{0} - page: {1}/{2}\r'.format(
-                topic, cnt, json_out['pages'])
-            sys.stdout.write(info)
-            sys.stdout.flush()
-            messages.extend(json_out['raw_messages'])
-            cnt += 1
-            if cnt > int(json_out['pages']):
-                break
-        json_out = messages
+        json_out = []
+        for messages in iter_datagrepper(start, end, topic, workers=workers):
+            json_out.extend(messages)
     return json_out
 
 
+def count_contributors(topic, pages, users=None):
+    """ Count the number of messages each user is responsible for on a
+    topic.
+
+    The pages are counted as they come and dropped afterward.
+
+    :arg topic: the name of the topic (as in TOPICS) the messages are
+        from.
+    :arg pages: an iterable of lists of messages, as returned by
+        `iter_datagrepper`.
+    :kwarg users: a dictionary of the counts to update, a new one is
+        created if not specified.
+
+    """
+    if users is None:
+        users = {}
+    for messages in pages:
+        for msg in messages:
+            for user in msg['meta']['usernames']:
+                # Some users are system accounts.
+                if user in BLACK_LIST_USERS:
+                    continue
+
+                # Other returned users aren't actually responsible for the
+                # event in a way that we want counted.  (SCM admins, here)
+                if topic == 'New packages' and user == msg['msg']['agent']:
+                    continue
+
+                users[user] = users.get(user, 0) + 1
+    return users
+
+
+def get_top_users(users, top=3):
+    """ Return the users with the `top` highest numbers of contributions
+    as a dictionary associating the number of contributions to the list
+    of users having it.
+
+    :arg users: a dictionary associating each user to its number of
+        contributions.
+    :kwarg top: the number of distinct counts to keep.
+
+    """
+    counts = heapq.nlargest(top, set(users.values()))
+    top_users = dict((count, []) for count in counts)
+    for user, count in users.items():
+        if count in top_users:
+            top_users[count].append(user)
+    return top_users
+
+
 def get_fedora_contributors(datetime_to, datetime_from):
     """ Retrieve the top contributors for that week for each topics
 
@@ -119,43 +1148,204 @@ def get_fedora_contributors(datetime_to, datetime_from):
     print 'Get contributions of week {0}'.format(datetime_from)
 
     for topic in topics:
-        messages = query_datagrepper(
-            datetime_from, datetime_to, TOPICS[topic], full=True)
-        users = {}
-        for msg in messages:
-            for user in msg['meta']['usernames']:
-                # Some users are system accounts.
-                if user in BLACK_LIST_USERS:
-                    continue
+        users = count_contributors(topic, iter_datagrepper(
+            datetime_from, datetime_to, TOPICS[topic]))
+        contributors[topic] = get_top_users(users)
 
-                # Other returned users aren't actually responsible for the
-                # event in a way that we want counted.  (SCM admins, here)
-                if topic == 'New packages' and user == msg['msg']['agent']:
-                    continue
+    print '\n'
+
+    return contributors
+
+
+def get_days(datetime_from, datetime_to):
+    """ Return the list of the days ('%Y_%m_%d') between the two specified
+    dates, both included.
+
+    :arg datetime_from: a datetime object specifying the start of the
+        period.
+    :arg datetime_to: a datetime object specifying the end of the period.
 
-                if user in users:
-                    users[user] += 1
+    """
+    days = []
+    day = datetime(datetime_from.year, datetime_from.month, datetime_from.day)
+    while day <= datetime_to:
+        days.append(day.strftime('%Y_%m_%d'))
+        day += timedelta(days=1)
+    return days
+
+
+def _count_messages(topic, days, pages, shard=None):
+    """ Count the messages of a topic, in total, per day and per user.
+
+    Returns a tuple of the total number of messages, a dictionary of the
+    number of messages per day ('%Y_%m_%d') and a dictionary of the number
+    of contributions of each user.
+
+    :arg topic: the name of the topic (as in TOPICS) the messages are
+        from.
+    :arg days: the list of the days ('%Y_%m_%d') of the period, counted
+        even if they have no message.
+    :arg pages: an iterable of lists of messages, as returned by
+        `iter_datagrepper`.
+    :kwarg shard: the `ArchiveShard` to which to write the messages, if
+        any.
+
+    """
+    users = {}
+    total = 0
+    per_day = dict((day, 0) for day in days)
+    for messages in pages:
+        if shard:
+            shard.write(messages)
+        total += len(messages)
+        for msg in messages:
+            day = datetime.utcfromtimestamp(
+                msg['timestamp']).strftime('%Y_%m_%d')
+            per_day[day] = per_day.get(day, 0) + 1
+        # ignore user creation in top users
+        if topic != 'FAS user created':
+            count_contributors(topic, [messages], users)
+    return total, per_day, users
+
+
+def _fetch_topic(topic, datetime_to, datetime_from, days, workers,
+                 deadline=None):
+    """ Retrieve the messages of one topic over the specified week, for
+    `get_fedora_stats`, and return their counts as `_count_messages`
+    does.
+    """
+    shard = None
+    if ARCHIVE_DIR:
+        shard = ArchiveShard(TOPICS[topic], datetime_to)
+    try:
+        topic_stats = _count_messages(
+            topic, days, iter_datagrepper(
+                datetime_from, datetime_to, TOPICS[topic], workers=workers,
+                deadline=deadline),
+            shard=shard)
+    except Exception:
+        if shard:
+            shard.discard()
+        raise
+    if shard:
+        shard.close()
+    return topic_stats
+
+
+def _fetch_topics(topics, fetch, deadline=None):
+    """ Call `fetch` for each of the topics at the same time and return a
+    tuple of the dictionary of the result of each topic and of the list
+    of the topics which could not be retrieved before the deadline, or
+    failed.
+
+    :arg topics: the list of the topics to retrieve.
+    :arg fetch: the function retrieving one topic, called with the name
+        of the topic.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        the topics not retrieved yet are left pending. Without deadline
+        the first topic failing raises its error.
+
+    """
+    from multiprocessing import TimeoutError
+    from multiprocessing.pool import ThreadPool
+
+    # The queries of all the topics share the limit of the controller
+    pool = ThreadPool(max(1, len(topics)))
+    results = [(topic, pool.apply_async(fetch, (topic,)))
+               for topic in topics]
+    pool.close()
+
+    output = {}
+    pending = []
+    try:
+        for topic, result in results:
+            try:
+                if deadline is None:
+                    output[topic] = result.get()
                 else:
-                    users[user] = 1
+                    output[topic] = result.get(max(0, deadline - time.time()))
+            except TimeoutError:
+                print '\n{0} pending, the time budget ran out'.format(topic)
+                pending.append(topic)
+            except Exception as err:
+                if deadline is None:
+                    raise
+                print '\n{0} pending, {1}: {2}'.format(
+                    topic, err.__class__.__name__, err)
+                pending.append(topic)
+    finally:
+        # Do not wait for the topics left pending, they stop by
+        # themselves after their current query
+        pool.terminate()
+
+    return output, pending
+
+
+def get_fedora_stats(datetime_to, datetime_from, workers=CONCURRENCY,
+                     topics=None, deadline=None):
+    """ Retrieve the activity in Fedora, per week and per day, and the
+    top contributors for each topic over the specified week.
+
+    Each topic is crawled only once, its number of messages giving the
+    activity, the topics being crawled at the same time. Returns a
+    dictionary with:
+
+    - `activities`: the number of messages of each topic,
+    - `contributors`: the top contributors of each topic, except the
+      creation of FAS users,
+    - `daily`: the number of messages of each topic per day,
+    - `users`: the number of contributions of each user per topic,
+    - `pending`: the topics which could not be retrieved before the
+      deadline, or failed, and are missing from the others.
 
-        # invert dict
-        ord_users = {}
-        for key in users:
-            if users[key] in ord_users:
-                ord_users[users[key]].append(key)
-            else:
-                ord_users[users[key]] = [key]
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week to retrieve.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week to retrieve.
+    :kwarg workers: the number of pages retrieved at the same time.
+    :kwarg topics: the list of topics to retrieve, defaults to all of
+        them.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        the topics not retrieved yet are left pending. Without deadline
+        the first topic failing raises its error.
+
+    """
+    print 'Get activities and contributions of week {0}'.format(
+        datetime_from)
+
+    days = get_days(datetime_from, datetime_to)
+
+    def _fetch(topic):
+        return _fetch_topic(
+            topic, datetime_to, datetime_from, days, workers, deadline)
 
-        contributors[topic] = {}
-        for key in sorted(ord_users.keys(), reverse=True)[:3]:
-            contributors[topic][key] = ord_users[key]
+    results, pending = _fetch_topics(
+        sorted(topics or TOPICS), _fetch, deadline)
+
+    activities = {}
+    contributors = {}
+    daily = {}
+    all_users = {}
+    for topic in sorted(results):
+        activities[topic], daily[topic], users = results[topic]
+        # ignore user creation in top users
+        if topic != 'FAS user created':
+            contributors[topic] = get_top_users(users)
+            all_users[topic] = users
 
     print '\n'
 
-    return contributors
+    return {
+        'activities': activities,
+        'contributors': contributors,
+        'daily': daily,
+        'users': all_users,
+        'pending': pending,
+    }
 
 
-def get_fedora_activity(datetime_to, datetime_from):
+def get_fedora_activity(datetime_to, datetime_from,
+                        concurrency=CONCURRENCY, topics=None):
     """ Retrieve the activity in Fedora over the week prior to the
     specified date.
 
@@ -163,58 +1353,117 @@ def get_fedora_activity(datetime_to, datetime_from):
         time of the week to retrieve.
     :arg datetime_from: a datetime object specifying the ending date and
         time of the week to retrieve.
+    :kwarg concurrency: the maximum number of topics queried at the same
+        time.
+    :kwarg topics: the list of topics to query, defaults to all of them.
 
     """
     print 'Get activities of week {0}'.format(datetime_from)
 
-    activities = {}
-    for topic in TOPICS:
-        activities[topic] = query_datagrepper(datetime_from, datetime_to,
-                                              TOPICS[topic])
+    def _query(topic):
+        return query_datagrepper(datetime_from, datetime_to, TOPICS[topic])
+
+    from multiprocessing.pool import ThreadPool
+
+    topics = sorted(topics or TOPICS)
+    pool = ThreadPool(max(1, min(concurrency, len(topics))))
+    try:
+        counts = pool.map(_query, topics)
+    finally:
+        pool.close()
+        pool.join()
+    activities = dict(zip(topics, counts))
     print '\n'
 
     return activities
 
 
-def create_blog_post(datetime_to, datetime_from, activities,
-                     previous_activities, top_contributors):
-    """ Create a new blog post.
+def get_previous_activities(datetime_to, datetime_from, evolution,
+                            query=True):
+    """ Retrieve the activity in Fedora over the week prior to the one
+    specified, using the totals stored in the evolution log and only
+    querying datagrepper for the topics missing there.
 
     :arg datetime_to: a datetime object specifying the starting date and
-        time of the week to retrieve.
+        time of the week whose previous week to retrieve.
     :arg datetime_from: a datetime object specifying the ending date and
-        time of the week to retrieve.
-    :arg activities: a dictionnary giving for each activity the number
-        of time it occured in the period of time.
-    :arg previous_activities: a dictionnary giving information about the
-        information the week before.
-    :arg top_contributors: a dictionnary giving information about the
-        top contributors of the week.
+        time of the week whose previous week to retrieve.
+    :arg evolution: a dictionary representing the evolution of the
+        activities over time as returned by `save_activities`.
+    :kwarg query: a boolean specifying whether to query datagrepper for
+        the topics missing in the evolution log.
 
     """
+    previous_to = datetime_to - timedelta(days=7)
+    previous_from = datetime_from - timedelta(days=7)
+    date_str = previous_to.strftime('%Y_%m_%d')
+
+    previous_activities = {}
+    for topic in TOPICS:
+        if date_str in evolution.get(topic, {}):
+            previous_activities[topic] = evolution[topic][date_str]
+
+    missing = set(TOPICS) - set(previous_activities)
+    if missing and query:
+        previous_activities.update(get_fedora_activity(
+            previous_to, previous_from, topics=missing))
+
+    return previous_activities
+
+
+def _format_activities(activities, previous_activities, pending=()):
+    """ Return the rows of the table of the activities of a blog post.
 
+    :arg activities: a dictionnary giving for each activity the number
+        of time it occured in the period of time, None if it is not
+        known.
+    :arg previous_activities: a dictionnary giving the same information
+        for the previous period of time.
+    :kwarg pending: the activities not retrieved yet.
+
+    """
     blog_entry = ''
-    for activity in sorted(activities.keys()):
+    for activity in sorted(set(activities) | set(pending)):
         diff = 'NA'
-        if activity in previous_activities:
+        amount = activities.get(activity)
+        if activity in pending:
+            amount = 'pending'
+        elif activity in previous_activities \
+                and amount is not None \
+                and previous_activities[activity] is not None:
             old_activity = previous_activities[activity]
             if old_activity == 0:
                 diff = 'NA'
             else:
-                pcent = activities[activity] * 100 / float(old_activity) - 100
+                pcent = amount * 100 / float(old_activity) - 100
                 plus_sign = ['-', '+'][pcent > 0]
                 diff = "{0}{1:05.2f}%".format(plus_sign, math.fabs(pcent))
 
         blog_entry += '{0} {1}  {2}\n'.format(
             activity.ljust(20),
-            str(activities[activity]).rjust(10),
+            str('NA' if amount is None else amount).rjust(10),
             diff.rjust(15))
+    return blog_entry.strip()
+
 
+def _format_contributors(top_contributors, pending=(), approximate=()):
+    """ Return the rows of the table of the top contributors of a blog
+    post.
+
+    :arg top_contributors: a dictionnary giving information about the
+        top contributors of the period of time.
+    :kwarg pending: the activities not retrieved yet.
+    :kwarg approximate: the activities whose top contributors and their
+        numbers of contributions are only estimated.
+
+    """
     top_user_entry = ''
-    for activity in sorted(top_contributors.keys()):
-        entry = ''
+    for activity in sorted(set(top_contributors) | set(pending)):
+        entry = 'pending, ' if activity in pending else ''
+        if activity in approximate:
+            entry += 'approximate, '
         cnt = 0
-        for top in sorted(top_contributors[activity].keys(), reverse=True):
+        for top in sorted(top_contributors.get(activity, {}), reverse=True):
             for contrib in sorted(top_contributors[activity][top]):
                 if cnt >= 3:
                     break
@@ -225,8 +1474,48 @@ def create_blog_post(datetime_to, datetime_from, activities,
             ' ' * 5,
             entry.rsplit(',', 1)[0].strip(),
         )
+    return top_user_entry.strip()
 
-    content = """.. link:
+
+def _write_post(file_name, content):
+    """ Write the content of a blog post in the specified file of the
+    `posts` folder unless the file already holds this content, so that
+    the site is only rebuilt for the posts which changed. Returns whether
+    the file was written.
+
+    :arg file_name: the name of the file of the blog post.
+    :arg content: the content of the blog post.
+
+    """
+    path = os.path.join('posts', file_name)
+    if os.path.exists(path):
+        with open(path) as stream:
+            if stream.read() == content:
+                return False
+    with open(path, 'w') as stream:
+        stream.write(content)
+    return True
+
+
+def get_blog_post(datetime_to, datetime_from, activities,
+                  previous_activities, top_contributors, pending=None):
+    """ Return the content of the blog post of a week.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week to retrieve.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week to retrieve.
+    :arg activities: a dictionnary giving for each activity the number
+        of time it occured in the period of time.
+    :arg previous_activities: a dictionnary giving information about the
+        information the week before.
+    :arg top_contributors: a dictionnary giving information about the
+        top contributors of the week.
+    :kwarg pending: the list of the activities not retrieved yet.
+
+    """
+    pending = pending or []
+    return """.. link:
 .. description:
 .. date: {date_now}
 .. title: Activities from {date_from} to {date_to}
@@ -255,79 +1544,1444 @@ Activites                  Contributors
         date_from=datetime_from.strftime('%a, %d %b %Y'),
         date_to=datetime_to.strftime('%a, %d %b %Y'),
         slug_date=datetime_to.strftime('%Y_%m_%d'),
-        content=blog_entry.strip(),
-        top_user=top_user_entry.strip(),
+        content=_format_activities(
+            activities, previous_activities, pending),
+        # ignore user creation in top users
+        top_user=_format_contributors(top_contributors, [
+            topic for topic in pending if topic != 'FAS user created']),
     )
 
-    file_name = '{0}.txt'.format(datetime_to.strftime('%Y_%m_%d'))
-    with open(os.path.join('posts', file_name), 'w') as stream:
-        stream.write(content)
-
 
-def save_activities(datetime_to, activities):
-    """ Add the activities of the week to the json string in the file
-    `evolution.txt` which contains the activities week after week.
+def create_blog_post(datetime_to, datetime_from, activities,
+                     previous_activities, top_contributors, pending=None):
+    """ Create a new blog post, returns whether its file was written.
 
     :arg datetime_to: a datetime object specifying the starting date and
         time of the week to retrieve.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week to retrieve.
     :arg activities: a dictionnary giving for each activity the number
         of time it occured in the period of time.
+    :arg previous_activities: a dictionnary giving information about the
+        information the week before.
+    :arg top_contributors: a dictionnary giving information about the
+        top contributors of the week.
+    :kwarg pending: the list of the activities not retrieved yet.
 
     """
+    content = get_blog_post(datetime_to, datetime_from, activities,
+                            previous_activities, top_contributors, pending)
+    file_name = '{0}.txt'.format(datetime_to.strftime('%Y_%m_%d'))
+    return _write_post(file_name, content)
 
-    date_str = datetime_to.strftime('%Y_%m_%d')
-    file_name = 'evolution.txt'
 
-    if os.path.exists(file_name):
-        with open(file_name) as stream:
-            output = json.loads(stream.read())
-    else:
-        output = {}
+def parse_post_contributors(file_name):
+    """ Return the top contributors listed in the table of a blog post, in
+    the format of `get_top_users` for each activity, or None if the post
+    has no such table.
 
-    for activity in sorted(activities.keys()):
-        if activity not in output:
-            output[activity] = {date_str: activities[activity]}
-        else:
-            output[activity][date_str] = activities[activity]
+    :arg file_name: the path of the blog post.
 
-    with open(file_name, 'w') as stream:
-        stream.write(json.dumps(output))
+    """
+    with open(file_name) as stream:
+        lines = stream.read().split('\n')
+    try:
+        start = lines.index('Activites                  Contributors') + 2
+    except ValueError:
+        return None
+
+    top_contributors = {}
+    for line in lines[start:]:
+        if line.startswith('='):
+            break
+        top_users = top_contributors.setdefault(line[:20].strip(), {})
+        for user, count in re.findall(r'(\S+) \((\d+)\)', line[20:]):
+            top_users.setdefault(int(count), []).append(user)
+    return top_contributors
+
+
+def create_rollup_post(period, datetime_to, datetime_from, title, slug,
+                       activities, previous_activities, top_contributors,
+                       approximate=None):
+    """ Create a blog post summarizing the activities over a month or a
+    year.
+
+    :arg period: the kind of period summarized, `month` or `year`.
+    :arg datetime_to: a datetime object specifying the end of the period.
+    :arg datetime_from: a datetime object specifying the start of the
+        period.
+    :arg title: the title of the blog post.
+    :arg slug: the slug of the blog post, also the name of its file.
+    :arg activities: a dictionnary giving for each activity the number
+        of time it occured in the period of time.
+    :arg previous_activities: a dictionnary giving the same information
+        for the previous period.
+    :arg top_contributors: a dictionnary giving information about the
+        top contributors of the period.
+    :kwarg approximate: the list of the activities whose top
+        contributors are only estimated, marked as such in the post.
 
-    return output
+    """
+    top_title = 'Top contributors of the {0}'.format(period)
+    content = """.. link:
+.. description:
+.. date: {date_now}
+.. title: {title}
+.. slug: {slug}
 
+Activities
+----------
 
-def generate_svg(evolution):
-    """ Reads in the json string contained in `evolution.txt` and
-    generate the evolution graph from it using pygal.
+======================    ========   ======================
+Activities                 Amount     {diff_title}
+======================    ========   ======================
+{content}
+======================    ========   ======================
 
-    :arg evolution: a dictionary representing the evolution of the
-        activities over time.
+{top_title}
+{top_underline}
 
-    """
-    config = pygal.Config()
-    config.css.append('http://thisweekinfedora.org/assets/css/svg.css')
+======================    ==============
+Activites                  Contributors
+======================    ==============
+{top_user}
+======================    ==============
 
-    line_chart = pygal.Line(config)
-    lbls = []
-    for activity in sorted(evolution.keys()):
+""".format(
+        date_now=datetime_to.strftime('%Y/%m/%d %H:%M:%S'),
+        title=title,
+        slug=slug,
+        diff_title='Diff to previous {0}'.format(period),
+        content=_format_activities(activities, previous_activities),
+        top_title=top_title,
+        top_underline='-' * len(top_title),
+        top_user=_format_contributors(
+            top_contributors, approximate=approximate or ()),
+    )
+
+    return _write_post('{0}.txt'.format(slug), content)
+
+
+def _lock_file(file_name, exclusive=True):
+    """ Open and lock the lock file associated to the specified data file
+    and return it, the lock is released when the returned file is closed.
+
+    The lock file is distinct from the data file so that the data file
+    can be replaced while it is held.
+
+    :arg file_name: the path of the data file to lock.
+    :kwarg exclusive: a boolean specifying whether the lock is exclusive
+        (to write) or shared (to read).
+
+    """
+    stream = open('{0}.lock'.format(file_name), 'a')
+    fcntl.flock(stream, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return stream
+
+
+def _append_records(file_name, records):
+    """ Append records, one json object per line, at the end of the
+    specified file.
+
+    A truncated last line, left by an interrupted writer, is ended first
+    so that the first record appended is not joined to it.
+
+    :arg file_name: the path of the file to append to.
+    :arg records: a list of json-serializable dictionaries.
+
+    """
+    data = ''.join(
+        json.dumps(record, sort_keys=True) + '\n' for record in records)
+    with _lock_file(file_name):
+        with open(file_name, 'a+') as stream:
+            stream.seek(0, os.SEEK_END)
+            if stream.tell():
+                stream.seek(-1, os.SEEK_END)
+                if stream.read(1) != '\n':
+                    data = '\n' + data
+                stream.seek(0, os.SEEK_END)
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+
+
+def _read_records(file_name, lock=True):
+    """ Return the list of records stored, one json object per line, in
+    the specified file.
+
+    A truncated last line, left by an interrupted writer, is ignored.
+
+    :arg file_name: the path of the file to read.
+    :kwarg lock: a boolean specifying whether to lock the file, False
+        when the caller already holds the lock.
+
+    """
+    if not os.path.exists(file_name):
+        return []
+    records = []
+    lock_stream = _lock_file(file_name, exclusive=False) if lock else None
+    try:
+        with open(file_name) as stream:
+            for line in stream:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    finally:
+        if lock_stream:
+            lock_stream.close()
+    return records
+
+
+def _write_records(file_name, records):
+    """ Replace the content of the specified file with the provided
+    records, one json object per line.
+
+    The records are written to a temporary file which then replaces the
+    original one, so readers never see a partial file. The caller must
+    hold the lock of the file.
+
+    :arg file_name: the path of the file to write.
+    :arg records: a list of json-serializable dictionaries.
+
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as stream:
+        for record in records:
+            stream.write(json.dumps(record, sort_keys=True) + '\n')
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.rename(tmp_path, file_name)
+
+
+def import_evolution(file_name=EVOLUTION_FILE):
+    """ Import the activities stored in the json string of the file
+    `evolution.txt` into the evolution log.
+
+    The weeks already in the log are kept as they are.
+
+    :kwarg file_name: the path of the file to import.
+
+    """
+    with open(file_name) as stream:
+        evolution = json.loads(stream.read())
+
+    weeks = {}
+    for activity in evolution:
+        for date_str, count in evolution[activity].items():
+            weeks.setdefault(date_str, {})[activity] = count
+
+    records = [{'week': date_str, 'activities': weeks[date_str]}
+               for date_str in sorted(weeks)]
+    with _lock_file(EVOLUTION_LOG):
+        # Records at the end of the log win over the imported ones
+        _write_records(EVOLUTION_LOG, records + _read_records(
+            EVOLUTION_LOG, lock=False))
+
+
+def load_evolution():
+    """ Return the activities stored week after week in the evolution
+    log as a dictionary associating to each activity a dictionary of the
+    number of time it occured each week.
+
+    The content of `evolution.txt` is imported first if the log does not
+    exist yet.
+
+    """
+    if not os.path.exists(EVOLUTION_LOG) and os.path.exists(EVOLUTION_FILE):
+        import_evolution()
+
+    output = {}
+    for record in _read_records(EVOLUTION_LOG):
+        for activity, count in record['activities'].items():
+            output.setdefault(activity, {})[record['week']] = count
+    return output
+
+
+def load_pending():
+    """ Return the activities left pending week after week in the
+    evolution log as a dictionary associating to each week ('%Y_%m_%d')
+    the set of the activities not retrieved in one of its runs, some of
+    which may have been retrieved by a later run.
+    """
+    output = {}
+    for record in _read_records(EVOLUTION_LOG):
+        if record.get('pending'):
+            output.setdefault(record['week'], set()).update(
+                record['pending'])
+    return output
+
+
+def get_week_activities(datetime_to, evolution=None):
+    """ Return the activities stored for the specified week.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week to retrieve.
+    :kwarg evolution: a dictionary representing the evolution of the
+        activities over time as returned by `load_evolution`, loaded from
+        the evolution log if not specified.
+
+    """
+    if evolution is None:
+        evolution = load_evolution()
+    date_str = datetime_to.strftime('%Y_%m_%d')
+    activities = {}
+    for activity in evolution:
+        if date_str in evolution[activity]:
+            activities[activity] = evolution[activity][date_str]
+    return activities
+
+
+def compact_evolution():
+    """ Rewrite the evolution log keeping only one record per week, the
+    weeks being sorted.
+    """
+    with _lock_file(EVOLUTION_LOG):
+        weeks = {}
+        for record in _read_records(EVOLUTION_LOG, lock=False):
+            weeks.setdefault(record['week'], {}).update(
+                record['activities'])
+        _write_records(EVOLUTION_LOG, [
+            {'week': date_str, 'activities': weeks[date_str]}
+            for date_str in sorted(weeks)])
+
+
+def save_activities(datetime_to, activities, pending=None):
+    """ Append the activities of the week to the evolution log which
+    contains the activities week after week.
+
+    The log is not read, the callers needing the evolution of the
+    activities over time load it or update the one they hold.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week to retrieve.
+    :arg activities: a dictionnary giving for each activity the number
+        of time it occured in the period of time.
+    :kwarg pending: the list of the activities not retrieved yet, which
+        are recorded as such and stored by a later record.
+
+    """
+    date_str = datetime_to.strftime('%Y_%m_%d')
+    record = {'week': date_str, 'activities': activities}
+    if pending:
+        record['pending'] = pending
+
+    # Make sure evolution.txt gets imported before the log is created
+    if not os.path.exists(EVOLUTION_LOG) and os.path.exists(EVOLUTION_FILE):
+        import_evolution()
+    _append_records(EVOLUTION_LOG, [record])
+
+
+class DayIndex(object):
+    """ Number of messages of each topic day after day, with their
+    cumulative sums so that the number of messages over any range of days
+    is known without querying datagrepper.
+
+    The counts of a topic are stored in a list starting at `start`, the
+    days not retrieved yet being None.
+    """
+
+    def __init__(self, start=None, topics=None):
+        """ Constructor.
+
+        :kwarg start: the first day of the index, as a '%Y_%m_%d' string.
+        :kwarg topics: a dictionary associating to each topic the list of
+            its counts day after day from `start`.
+
+        """
+        self.start = datetime.strptime(start, '%Y_%m_%d') if start else None
+        self.topics = topics or {}
+        self._sums = {}
+        self._known = {}
+        for topic in self.topics:
+            self._accumulate(topic, 0)
+
+    @classmethod
+    def load(cls, file_name=DAILY_INDEX):
+        """ Load the index from the specified file, an empty index is
+        returned if it does not exist.
+
+        :kwarg file_name: the path of the file storing the index.
+
+        """
+        if not os.path.exists(file_name):
+            return cls()
+        with open(file_name) as stream:
+            data = json.loads(stream.read())
+        return cls(data['start'], data['topics'])
+
+    def save(self, file_name=DAILY_INDEX):
+        """ Write the index to the specified file. The caller must hold
+        the lock of the file.
+
+        :kwarg file_name: the path of the file storing the index.
+
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+        with os.fdopen(fd, 'w') as stream:
+            stream.write(json.dumps({
+                'start': self.start.strftime('%Y_%m_%d'),
+                'topics': self.topics,
+            }, sort_keys=True))
+        os.rename(tmp_path, file_name)
+
+    def _offset(self, day):
+        """ Return the position of the day, a datetime or a '%Y_%m_%d'
+        string, in the lists of counts.
+        """
+        if not isinstance(day, datetime):
+            day = datetime.strptime(day, '%Y_%m_%d')
+        day = datetime(day.year, day.month, day.day)
+        return (day - self.start).days
+
+    def _accumulate(self, topic, offset):
+        """ Update the cumulative sums of a topic from the specified
+        position.
+        """
+        counts = self.topics[topic]
+        sums = self._sums.setdefault(topic, [0])
+        known = self._known.setdefault(topic, [0])
+        del sums[offset + 1:]
+        del known[offset + 1:]
+        for count in counts[offset:]:
+            sums.append(sums[-1] + (count or 0))
+            known.append(known[-1] + (count is not None))
+
+    def add(self, topic, day, count):
+        """ Set the number of messages of a topic for one day.
+
+        :arg topic: the name of the topic.
+        :arg day: the day, as a '%Y_%m_%d' string.
+        :arg count: the number of messages of the topic that day.
+
+        """
+        if self.start is None:
+            self.start = datetime.strptime(day, '%Y_%m_%d')
+        offset = self._offset(day)
+        if offset < 0:
+            # Day before the start, shift every topic
+            for name in self.topics:
+                self.topics[name] = [None] * -offset + self.topics[name]
+                self._accumulate(name, 0)
+            self.start -= timedelta(days=-offset)
+            offset = 0
+
+        counts = self.topics.setdefault(topic, [])
+        first = min(offset, len(counts))
+        if offset >= len(counts):
+            counts.extend([None] * (offset - len(counts) + 1))
+        counts[offset] = count
+        self._accumulate(topic, first)
+
+    def total(self, topic, start, end):
+        """ Return the number of messages of a topic between the two
+        specified days, both included, or None if some of these days are
+        not in the index.
+
+        :arg topic: the name of the topic.
+        :arg start: the first day of the range, a datetime or a
+            '%Y_%m_%d' string.
+        :arg end: the last day of the range, a datetime or a '%Y_%m_%d'
+            string.
+
+        """
+        if self.start is None or topic not in self.topics:
+            return None
+        first = self._offset(start)
+        last = self._offset(end) + 1
+        if first < 0 or last > len(self.topics[topic]) or first >= last:
+            return None
+        known = self._known[topic]
+        if known[last] - known[first] != last - first:
+            return None
+        sums = self._sums[topic]
+        return sums[last] - sums[first]
+
+
+def update_daily_index(daily, file_name=DAILY_INDEX):
+    """ Store the number of messages per day in the day index.
+
+    :arg daily: a dictionary associating to each topic a dictionary of
+        its number of messages per day ('%Y_%m_%d').
+    :kwarg file_name: the path of the file storing the index.
+
+    """
+    with _lock_file(file_name):
+        index = DayIndex.load(file_name)
+        for topic in sorted(daily):
+            for day in sorted(daily[topic]):
+                index.add(topic, day, daily[topic][day])
+        index.save(file_name)
+    return index
+
+
+def get_period_activities(start, end, index=None, evolution=None):
+    """ Return the number of messages of each topic between the two
+    specified days, both included, from the day index.
+
+    The topics not in the day index for the whole period, such as the
+    weeks stored before it existed, are counted from the weekly totals of
+    the evolution log instead, each week being counted in the period its
+    Sunday is in. The topics known by neither are None.
+
+    :arg start: the first day of the period, a datetime object.
+    :arg end: the last day of the period, a datetime object.
+    :kwarg index: the `DayIndex` to use, loaded from DAILY_INDEX if not
+        specified.
+    :kwarg evolution: a dictionary representing the evolution of the
+        activities over time as returned by `load_evolution`, loaded from
+        the evolution log if needed and not specified.
+
+    """
+    if index is None:
+        index = DayIndex.load()
+    activities = dict(
+        (topic, index.total(topic, start, end)) for topic in TOPICS)
+
+    missing = [topic for topic in TOPICS if activities[topic] is None]
+    if missing:
+        if evolution is None:
+            evolution = load_evolution()
+        start = start.strftime('%Y_%m_%d')
+        end = end.strftime('%Y_%m_%d')
+        for topic in missing:
+            counts = [count for week, count in evolution.get(topic, {}).items()
+                      if start <= week <= end and count is not None]
+            if counts:
+                activities[topic] = sum(counts)
+    return activities
+
+
+class HyperLogLog(object):
+    """ Sketch estimating the number of distinct users it was given, in
+    a fixed amount of memory, which can be merged with other sketches to
+    estimate the number of distinct users over all of them.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        """ Constructor.
+
+        :kwarg precision: the number of bits of the hash selecting the
+            register.
+        :kwarg registers: a bytearray of the 2 ** precision registers,
+            all empty if not specified.
+
+        """
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            registers = bytearray(self.size)
+        self.registers = registers
+
+    def add(self, value):
+        """ Add a user to the sketch.
+
+        :arg value: the name of the user.
+
+        """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        hashed = int(hashlib.sha1(value).hexdigest()[:16], 16)
+        register = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the first bit set in the rest of the hash
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def update(self, other):
+        """ Merge another sketch of the same precision into this one.
+
+        :arg other: the `HyperLogLog` to merge.
+
+        """
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precisions')
+        for idx, rank in enumerate(other.registers):
+            if rank > self.registers[idx]:
+                self.registers[idx] = rank
+
+    def count(self):
+        """ Return the estimated number of distinct users. """
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(
+            2.0 ** -rank for rank in self.registers)
+        zeros = sum(1 for rank in self.registers if not rank)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small numbers
+            estimate = self.size * math.log(self.size / float(zeros))
+        return int(round(estimate))
+
+    def to_string(self):
+        """ Return the sketch serialized as a string. """
+        return '{0}:{1}'.format(
+            self.precision, base64.b64encode(str(self.registers)))
+
+    @classmethod
+    def from_string(cls, string):
+        """ Return the sketch serialized in the specified string.
+
+        :arg string: a string as returned by `to_string`.
+
+        """
+        precision, registers = string.split(':', 1)
+        return cls(int(precision), bytearray(base64.b64decode(registers)))
+
+
+class SpaceSaving(object):
+    """ Summary of the most active users, keeping at most `capacity`
+    counters (Space-Saving algorithm), which can be merged with other
+    summaries.
+
+    Each counter records the number of contributions of a user and by
+    how much it may be over-estimated. The over-estimation is at most the
+    total number of contributions divided by the capacity.
+
+    A summary built from a ranking listing only the most active users
+    records as its floor the number of contributions of the least active
+    of them, which the users not listed may have reached.
+    """
+
+    def __init__(self, capacity=HEAVY_HITTERS_CAPACITY, counters=None,
+                 total=0, floor=0):
+        """ Constructor.
+
+        :kwarg capacity: the maximum number of users kept.
+        :kwarg counters: a dictionary associating to each user a list of
+            its number of contributions and of its over-estimation.
+        :kwarg total: the total number of contributions summarized.
+        :kwarg floor: the maximum number of contributions of a user who
+            is not in the summary, even if it is not full.
+
+        """
+        self.capacity = capacity
+        self.counters = counters or {}
+        self.total = total
+        self.floor = floor
+
+    @classmethod
+    def from_counts(cls, users, capacity=HEAVY_HITTERS_CAPACITY,
+                    truncated=False):
+        """ Return the summary of exact numbers of contributions.
+
+        :arg users: a dictionary associating each user to its number of
+            contributions.
+        :kwarg capacity: the maximum number of users kept.
+        :kwarg truncated: a boolean specifying whether `users` only lists
+            the most active users, the others having at most as many
+            contributions as the least active of them.
+
+        """
+        kept = heapq.nlargest(
+            capacity, users.items(), key=lambda item: (item[1], item[0]))
+        floor = 0
+        if truncated and users:
+            floor = min(users.values())
+        return cls(capacity, dict((user, [count, 0]) for user, count in kept),
+                   sum(users.values()), floor)
+
+    def _floor(self):
+        """ Return the maximum number of contributions of a user who is
+        not in the summary.
+        """
+        if len(self.counters) < self.capacity:
+            return self.floor
+        return max(self.floor,
+                   min(count for count, _ in self.counters.values()))
+
+    def add(self, user, count=1):
+        """ Count contributions of a user.
+
+        :arg user: the name of the user.
+        :kwarg count: the number of contributions.
+
+        """
+        self.total += count
+        if user in self.counters:
+            self.counters[user][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[user] = [self.floor + count, self.floor]
+        else:
+            # Replace the least active user, whose count becomes the
+            # possible over-estimation of the new one
+            least = min(self.counters, key=lambda key: self.counters[key][0])
+            floor = self.counters.pop(least)[0]
+            self.counters[user] = [floor + count, floor]
+
+    def update(self, other):
+        """ Merge another summary into this one.
+
+        :arg other: the `SpaceSaving` to merge.
+
+        """
+        floor = self._floor()
+        other_floor = other._floor()
+        merged = {}
+        for user in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(user, [floor, floor])
+            other_count, other_error = other.counters.get(
+                user, [other_floor, other_floor])
+            merged[user] = [count + other_count, error + other_error]
+        kept = heapq.nlargest(
+            self.capacity, merged.items(),
+            key=lambda item: (item[1][0], item[0]))
+        self.counters = dict(kept)
+        self.total += other.total
+        # A user in neither summary may have reached both floors
+        self.floor = floor + other_floor
+
+    def is_exact(self, users):
+        """ Return whether the numbers of contributions of the specified
+        users are exact, and no user outside of them may have more
+        contributions than one of them.
+
+        :arg users: a list of users in the summary.
+
+        """
+        floor = self._floor()
+        for user in users:
+            count, error = self.counters[user]
+            if error or count < floor:
+                return False
+        return True
+
+    def counts(self, guaranteed=False):
+        """ Return a dictionary of the estimated number of contributions of
+        each user in the summary.
+
+        :kwarg guaranteed: a boolean specifying whether to return the
+            number of contributions each user has at least instead.
+
+        """
+        return dict(
+            (user, count - error if guaranteed else count)
+            for user, (count, error) in self.counters.items())
+
+    def top(self, size):
+        """ Return the `size` most active users as a list of (user,
+        contributions, maximum over-estimation) tuples.
+
+        :arg size: the number of users to return.
+
+        """
+        kept = heapq.nlargest(
+            size, self.counters.items(),
+            key=lambda item: (item[1][0], item[0]))
+        return [(user, count, error) for user, (count, error) in kept]
+
+    def to_dict(self):
+        """ Return the summary as a json-serializable dictionary. """
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'floor': self.floor,
+            'counters': sorted(
+                [user, count, error]
+                for user, (count, error) in self.counters.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Return the summary serialized in the specified dictionary.
+
+        :arg data: a dictionary as returned by `to_dict`.
+
+        """
+        return cls(data['capacity'], dict(
+            (user, [count, error]) for user, count, error in data['counters']),
+            data['total'], data.get('floor', 0))
+
+
+def save_contributors(datetime_to, users):
+    """ Append the top contributors of the week to the contributors log,
+    keeping the STORED_CONTRIBUTORS most active users of each topic, a
+    summary of the HEAVY_HITTERS_CAPACITY most active ones and a sketch of
+    all the distinct users of each topic.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg users: a dictionary associating to each topic the dictionary of
+        the number of contributions of each user.
+
+    """
+    contributors = {}
+    distinct = {}
+    heavy = {}
+    for topic in users:
+        contributors[topic] = heapq.nlargest(
+            STORED_CONTRIBUTORS, users[topic].items(),
+            key=lambda item: (item[1], item[0]))
+        sketch = HyperLogLog()
+        for user in users[topic]:
+            sketch.add(user)
+        distinct[topic] = sketch.to_string()
+        heavy[topic] = SpaceSaving.from_counts(users[topic]).to_dict()
+    _append_records(CONTRIBUTORS_LOG, [{
+        'week': datetime_to.strftime('%Y_%m_%d'),
+        'contributors': contributors,
+        'distinct': distinct,
+        'heavy': heavy,
+    }])
+
+
+def load_contributors():
+    """ Return the contributors stored week after week in the contributors
+    log as a dictionary associating to each week ('%Y_%m_%d') a dictionary
+    of the number of contributions of each user for each topic.
+    """
+    output = {}
+    for record in _read_records(CONTRIBUTORS_LOG):
+        week = output.setdefault(record['week'], {})
+        for topic, ranking in record['contributors'].items():
+            week[topic] = dict(ranking)
+    return output
+
+
+def load_distinct_contributors():
+    """ Return the sketches of the distinct users stored week after week
+    in the contributors log as a dictionary associating to each week
+    ('%Y_%m_%d') a dictionary of the `HyperLogLog` of each topic.
+    """
+    output = {}
+    for record in _read_records(CONTRIBUTORS_LOG):
+        week = output.setdefault(record['week'], {})
+        for topic, sketch in record.get('distinct', {}).items():
+            week[topic] = HyperLogLog.from_string(sketch)
+    return output
+
+
+def get_distinct_contributors(start, end, sketches=None):
+    """ Return the estimated number of distinct users of each topic over
+    the weeks ending between the two specified days, both included, by
+    merging the sketches stored in the contributors log.
+
+    :arg start: the first day of the period, a datetime object.
+    :arg end: the last day of the period, a datetime object.
+    :kwarg sketches: the weekly sketches as returned by
+        `load_distinct_contributors`, loaded from the contributors log if
+        not specified.
+
+    """
+    if sketches is None:
+        sketches = load_distinct_contributors()
+    start = start.strftime('%Y_%m_%d')
+    end = end.strftime('%Y_%m_%d')
+
+    merged = {}
+    for week in sketches:
+        if not start <= week <= end:
+            continue
+        for topic, sketch in sketches[week].items():
+            if topic not in merged:
+                merged[topic] = HyperLogLog(sketch.precision)
+            merged[topic].update(sketch)
+
+    return dict((topic, merged[topic].count()) for topic in merged)
+
+
+def load_heavy_hitters():
+    """ Return the summaries of the most active users stored week after
+    week in the contributors log as a dictionary associating to each
+    week ('%Y_%m_%d') a dictionary of the `SpaceSaving` of each topic.
+
+    The weeks stored without summary get one built from their ranking,
+    and the weeks stored before the contributors log existed one built
+    from the top contributors listed in their blog post. These rankings
+    are truncated when they are full, the users not listed then having
+    at most as many contributions as the last one listed.
+    """
+    output = {}
+    for record in _read_records(CONTRIBUTORS_LOG):
+        week = output.setdefault(record['week'], {})
+        heavy = record.get('heavy', {})
+        for topic, ranking in record['contributors'].items():
+            if topic in heavy:
+                week[topic] = SpaceSaving.from_dict(heavy[topic])
+            else:
+                week[topic] = SpaceSaving.from_counts(
+                    dict(ranking),
+                    truncated=len(ranking) >= STORED_CONTRIBUTORS)
+
+    if os.path.isdir('posts'):
+        for file_name in sorted(os.listdir('posts')):
+            match = re.match(r'^(\d{4}_\d{2}_\d{2})\.txt$', file_name)
+            if not match or match.group(1) in output:
+                continue
+            top_contributors = parse_post_contributors(
+                os.path.join('posts', file_name))
+            if not top_contributors:
+                continue
+            week = output.setdefault(match.group(1), {})
+            for topic, top_users in top_contributors.items():
+                # The posts list at most 3 users
+                users = dict(
+                    (user, count) for count, names in top_users.items()
+                    for user in names)
+                week[topic] = SpaceSaving.from_counts(
+                    users, truncated=len(users) >= 3)
+    return output
+
+
+def _merge_heavy_hitters(start, end, summaries=None):
+    """ Return a dictionary associating to each topic the `SpaceSaving`
+    merging the summaries of the weeks ending between the two specified
+    days, both included.
+    """
+    if summaries is None:
+        summaries = load_heavy_hitters()
+    start = start.strftime('%Y_%m_%d')
+    end = end.strftime('%Y_%m_%d')
+
+    merged = {}
+    for week in sorted(summaries):
+        if not start <= week <= end:
+            continue
+        for topic, summary in summaries[week].items():
+            if topic not in merged:
+                merged[topic] = SpaceSaving(summary.capacity)
+            merged[topic].update(summary)
+    return merged
+
+
+def get_period_contributors(start, end, summaries=None, top=3):
+    """ Return the top contributors of each topic over the weeks ending
+    between the two specified days, both included, by merging the weekly
+    summaries of the most active users stored in the contributors log.
+
+    The users are ranked by the number of contributions they have at
+    least, which is exact unless some of the summaries are estimated or
+    were built from a truncated ranking, see
+    `get_approximate_contributors`.
+
+    :arg start: the first day of the period, a datetime object.
+    :arg end: the last day of the period, a datetime object.
+    :kwarg summaries: the weekly summaries as returned by
+        `load_heavy_hitters`, loaded from the contributors log if not
+        specified.
+    :kwarg top: the number of distinct counts to keep.
+
+    """
+    merged = _merge_heavy_hitters(start, end, summaries)
+    return dict(
+        (topic, get_top_users(merged[topic].counts(guaranteed=True),
+                              top=top))
+        for topic in merged)
+
+
+def get_approximate_contributors(start, end, top_contributors,
+                                 summaries=None):
+    """ Return the list of the topics whose top contributors over the
+    weeks ending between the two specified days, as returned by
+    `get_period_contributors`, are only estimated: the number of
+    contributions of one of them may be over-estimated, or a user not
+    listed may have more contributions than one of them.
+
+    This is the case of the weeks whose summary was built from a
+    truncated ranking, such as the top contributors listed in a post.
+
+    :arg start: the first day of the period, a datetime object.
+    :arg end: the last day of the period, a datetime object.
+    :arg top_contributors: the top contributors of each topic, as
+        returned by `get_period_contributors`.
+    :kwarg summaries: the weekly summaries as returned by
+        `load_heavy_hitters`, loaded from the contributors log if not
+        specified.
+
+    """
+    merged = _merge_heavy_hitters(start, end, summaries)
+    return [
+        topic for topic in sorted(top_contributors)
+        if not merged[topic].is_exact([
+            user for users in top_contributors[topic].values()
+            for user in users])]
+
+
+def get_leaderboard(start, end, topic, size=10, summaries=None):
+    """ Return the `size` most active users of a topic over the weeks
+    ending between the two specified days, both included, as a list of
+    (user, contributions, maximum over-estimation) tuples.
+
+    :arg start: the first day of the period, a datetime object.
+    :arg end: the last day of the period, a datetime object.
+    :arg topic: the name of the topic.
+    :kwarg size: the number of users to return.
+    :kwarg summaries: the weekly summaries as returned by
+        `load_heavy_hitters`, loaded from the contributors log if not
+        specified.
+
+    """
+    merged = _merge_heavy_hitters(start, end, summaries)
+    if topic not in merged:
+        return []
+    return merged[topic].top(size)
+
+
+def _connect_user_index(file_name=USER_INDEX):
+    """ Return a connection to the index of the contributions of the
+    users, creating its table if needed.
+
+    :kwarg file_name: the path of the SQLite database.
+
+    """
+    import sqlite3
+
+    connection = sqlite3.connect(file_name, timeout=60)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS contributions ('
+        ' user TEXT NOT NULL,'
+        ' topic TEXT NOT NULL,'
+        ' week TEXT NOT NULL,'
+        ' count INTEGER NOT NULL,'
+        ' PRIMARY KEY (user, topic, week))')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS contributions_week '
+        'ON contributions (week, topic)')
+    return connection
+
+
+def index_user_contributions(datetime_to, users, file_name=USER_INDEX):
+    """ Record the contributions of every user of the week in the index
+    of the contributions of the users, replacing the ones recorded for
+    the topics of that week before.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg users: a dictionary associating to each topic the dictionary of
+        the number of contributions of each user.
+    :kwarg file_name: the path of the SQLite database.
+
+    """
+    week = datetime_to.strftime('%Y_%m_%d')
+    connection = _connect_user_index(file_name)
+    try:
+        with connection:
+            connection.executemany(
+                'DELETE FROM contributions WHERE week = ? AND topic = ?',
+                [(week, topic) for topic in users])
+            connection.executemany(
+                'INSERT INTO contributions '
+                '(user, topic, week, count) VALUES (?, ?, ?, ?)',
+                [(user, topic, week, count)
+                 for topic in users
+                 for user, count in users[topic].items()])
+    finally:
+        connection.close()
+
+
+def save_user_contributions(datetime_to, users):
+    """ Append the contributions of every user of the week to USERS_LOG
+    and record them in the index of the contributions of the users.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg users: a dictionary associating to each topic the dictionary of
+        the number of contributions of each user.
+
+    """
+    # The index is missing on a new host, it is then rebuilt from the log
+    rebuild = not os.path.exists(USER_INDEX) and os.path.exists(USERS_LOG)
+    _append_records(USERS_LOG, [{
+        'week': datetime_to.strftime('%Y_%m_%d'),
+        'users': users,
+    }])
+    if rebuild:
+        rebuild_user_index()
+    else:
+        index_user_contributions(datetime_to, users)
+
+
+def rebuild_user_index(file_name=USER_INDEX):
+    """ Build again the index of the contributions of the users from the
+    weeks recorded in USERS_LOG, the later records of a week replacing
+    the earlier ones.
+
+    The index is built in a temporary file which then replaces the
+    current one, so readers never see a partial index.
+
+    :kwarg file_name: the path of the SQLite database.
+
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_name)), suffix='.tmp')
+    os.close(fd)
+    try:
+        for record in _read_records(USERS_LOG):
+            index_user_contributions(
+                datetime.strptime(record['week'], '%Y_%m_%d'),
+                record['users'], tmp_path)
+        os.rename(tmp_path, file_name)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def get_user_history(user, file_name=USER_INDEX):
+    """ Return the contributions of a user as a dictionary associating to
+    each topic a dictionary of the number of contributions per week
+    ('%Y_%m_%d').
+
+    :arg user: the name of the user.
+    :kwarg file_name: the path of the SQLite database.
+
+    """
+    if not os.path.exists(file_name) and os.path.exists(USERS_LOG):
+        rebuild_user_index(file_name)
+    connection = _connect_user_index(file_name)
+    try:
+        rows = connection.execute(
+            'SELECT topic, week, count FROM contributions WHERE user = ?',
+            (user,)).fetchall()
+    finally:
+        connection.close()
+
+    history = {}
+    for topic, week, count in rows:
+        history.setdefault(topic, {})[week] = count
+    return history
+
+
+def _archive_file(topic, week, day=None):
+    """ Return the path, in ARCHIVE_DIR, of the shard of the messages of
+    a topic over a week, or over one day of the week.
+    """
+    if day is None:
+        return os.path.join(topic, '{0}.jsonl.gz'.format(week))
+    return os.path.join(topic, '{0}.{1}.jsonl.gz'.format(week, day))
+
+
+def _index_shard(topic, week, count):
+    """ Record the shard of the messages of a topic over a week in the
+    index of the archive.
+    """
+    _append_records(os.path.join(ARCHIVE_DIR, 'index.jsonl'), [{
+        'topic': topic,
+        'week': week,
+        'file': _archive_file(topic, week),
+        'count': count,
+    }])
+
+
+class ArchiveShard(object):
+    """ Compressed file of the raw messages of one topic over one week,
+    one json object per line, in ARCHIVE_DIR.
+
+    The messages are written to a temporary file which replaces the shard
+    once all of them are written, and the shard is then recorded in the
+    index of the archive. The shard of one day of a week ingested day
+    after day is not recorded: `archive_ingested_week` joins the days
+    into the shard of the week once the week is over.
+    """
+
+    def __init__(self, topic, datetime_to, day=None):
+        """ Constructor.
+
+        :arg topic: the fedmsg topic of the messages.
+        :arg datetime_to: a datetime object specifying the starting date
+            and time of the week.
+        :kwarg day: the day ('%Y_%m_%d') of the messages, if they are only
+            the messages of one day of the week.
+
+        """
+        self.topic = topic
+        self.week = datetime_to.strftime('%Y_%m_%d')
+        self.day = day
+        self.file_name = _archive_file(topic, self.week, day)
+        folder = os.path.join(ARCHIVE_DIR, topic)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created in the meanwhile by another worker
+                pass
+        fd, self.tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        self.stream = gzip.GzipFile(
+            fileobj=os.fdopen(fd, 'wb'), mode='wb')
+        self.count = 0
+
+    def write(self, messages):
+        """ Append messages to the shard.
+
+        :arg messages: a list of raw messages as returned by datagrepper.
+
+        """
+        for msg in messages:
+            self.stream.write(json.dumps(msg, sort_keys=True) + '\n')
+        self.count += len(messages)
+
+    def close(self):
+        """ Replace the shard with the messages written and record it in
+        the index of the archive.
+        """
+        fileobj = self.stream.fileobj
+        self.stream.close()
+        fileobj.close()
+        os.rename(self.tmp_path, os.path.join(ARCHIVE_DIR, self.file_name))
+        if self.day is None:
+            _index_shard(self.topic, self.week, self.count)
+
+    def discard(self):
+        """ Drop the messages written, leaving the shard as it was. """
+        fileobj = self.stream.fileobj
+        self.stream.close()
+        fileobj.close()
+        os.remove(self.tmp_path)
+
+
+def load_archive_index():
+    """ Return the index of the archive as a dictionary associating to
+    each (fedmsg topic, week) the file of its messages and their number.
+    """
+    index = {}
+    for record in _read_records(os.path.join(ARCHIVE_DIR, 'index.jsonl')):
+        index[(record['topic'], record['week'])] = record
+    return index
+
+
+def archive_ingested_week(datetime_to, datetime_from, ingested):
+    """ Join the shards of the days of a week ingested day after day into
+    the shard of the week, for each topic having all of its days
+    archived, and record them in the index of the archive.
+
+    The days are joined as they are, a gzip file being readable as the
+    concatenation of several of them.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week.
+    :arg ingested: the data of the week, as returned by
+        `load_ingested_days`.
+
+    """
+    week = datetime_to.strftime('%Y_%m_%d')
+    days = get_days(datetime_from, datetime_to)
+    for topic in sorted(ingested):
+        fedmsg_topic = TOPICS[topic]
+        parts = [os.path.join(ARCHIVE_DIR,
+                              _archive_file(fedmsg_topic, week, day))
+                 for day in days]
+        if [part for part in parts if not os.path.exists(part)]:
+            print 'Some days of {0} are not archived for {1}'.format(
+                week, topic)
+            continue
+
+        folder = os.path.join(ARCHIVE_DIR, fedmsg_topic)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as stream:
+            for part in parts:
+                with open(part, 'rb') as part_stream:
+                    shutil.copyfileobj(part_stream, stream)
+        os.rename(tmp_path, os.path.join(
+            ARCHIVE_DIR, _archive_file(fedmsg_topic, week)))
+        _index_shard(fedmsg_topic, week, sum(
+            ingested[topic][day]['total'] for day in days))
+        for part in parts:
+            os.remove(part)
+
+
+def iter_archive(topic=None, weeks=None):
+    """ Iterate over the archived messages, yielding for each of them a
+    tuple of its fedmsg topic, its week ('%Y_%m_%d') and the message.
+
+    The shards are read one line at a time so the memory used does not
+    depend on their size.
+
+    :kwarg topic: the fedmsg topic to read, all of them if None.
+    :kwarg weeks: the list of weeks ('%Y_%m_%d') to read, all of them if
+        None.
+
+    """
+    index = load_archive_index()
+    for key in sorted(index):
+        if (topic and key[0] != topic) or (weeks and key[1] not in weeks):
+            continue
+        stream = gzip.open(os.path.join(ARCHIVE_DIR, index[key]['file']))
+        try:
+            for line in stream:
+                yield key[0], key[1], json.loads(line)
+        finally:
+            stream.close()
+
+
+def _iter_archive_pages(topic, week, size=100):
+    """ Iterate over the archived messages of a topic and week, yielding
+    them in lists of `size` like `iter_datagrepper` does.
+    """
+    page = []
+    for _, _, msg in iter_archive(topic=topic, weeks=[week]):
+        page.append(msg)
+        if len(page) >= size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def get_archived_stats(datetime_to, datetime_from):
+    """ Compute, from the archive only, the same data about a week as
+    `get_fedora_stats` retrieves from datagrepper. Returns None if the
+    messages of some topics of the week are not archived.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week.
+
+    """
+    week = datetime_to.strftime('%Y_%m_%d')
+    index = load_archive_index()
+    if any((TOPICS[topic], week) not in index for topic in TOPICS):
+        return None
+
+    days = get_days(datetime_from, datetime_to)
+
+    stats = {'activities': {}, 'contributors': {}, 'daily': {}, 'users': {}}
+    for topic in sorted(TOPICS):
+        total, per_day, users = _count_messages(
+            topic, days, _iter_archive_pages(TOPICS[topic], week))
+        stats['activities'][topic] = total
+        stats['daily'][topic] = per_day
+        if topic != 'FAS user created':
+            stats['contributors'][topic] = get_top_users(users)
+            stats['users'][topic] = users
+    return stats
+
+
+def lttb_indices(values, threshold):
+    """ Return the indices of the points to keep to downsample the
+    provided series to `threshold` points while keeping its shape, using
+    the Largest-Triangle-Three-Buckets algorithm.
+
+    :arg values: the list of the values of the series, the index being
+        the abscissa.
+    :arg threshold: the number of points to keep.
+
+    """
+    length = len(values)
+    if threshold >= length or threshold < 3:
+        return range(length)
+
+    indices = [0]
+    # The first and last points are always kept, the others are split
+    # in threshold - 2 buckets
+    every = float(length - 2) / (threshold - 2)
+    selected = 0
+    for bucket in range(threshold - 2):
+        # Average point of the next bucket
+        next_start = int(math.floor((bucket + 1) * every)) + 1
+        next_end = min(int(math.floor((bucket + 2) * every)) + 1, length)
+        avg_x = (next_start + next_end - 1) / 2.0
+        avg_y = sum(values[next_start:next_end]) / float(
+            next_end - next_start)
+
+        # Keep the point of the bucket making the largest triangle with
+        # the previously selected point and the average of the next bucket
+        bucket_start = int(math.floor(bucket * every)) + 1
+        bucket_end = int(math.floor((bucket + 1) * every)) + 1
+        max_area = -1
+        for idx in range(bucket_start, bucket_end):
+            area = math.fabs(
+                (selected - avg_x) * (values[idx] - values[selected])
+                - (selected - idx) * (avg_y - values[selected]))
+            if area > max_area:
+                max_area = area
+                next_selected = idx
+        indices.append(next_selected)
+        selected = next_selected
+
+    indices.append(length - 1)
+    return indices
+
+
+def generate_svg(evolution=None, max_points=SVG_MAX_POINTS, force=False):
+    """ Reads in the activities stored in the evolution log and
+    generate the evolution graph from it using pygal.
+
+    When there are more weeks than `max_points`, the weeks drawn are
+    selected using the Largest-Triangle-Three-Buckets algorithm on the
+    average of the series. The hash of the data is stored in the graph
+    and the graph is not generated again if the data did not change.
+
+    Returns whether the graph was generated.
+
+    :kwarg evolution: a dictionary representing the evolution of the
+        activities over time, loaded from the evolution log if not
+        specified.
+    :kwarg max_points: the maximum number of weeks drawn in the graph,
+        all the weeks are drawn if None.
+    :kwarg force: a boolean specifying whether to generate the graph
+        even if the data did not change.
+
+    """
+    if evolution is None:
+        evolution = load_evolution()
+
+    file_name = EVOLUTION_SVG
+    data_hash = hashlib.sha1(json.dumps(
+        [evolution, max_points], sort_keys=True)).hexdigest()
+    marker = '<!-- evolution: {0} -->'.format(data_hash)
+    if not force and os.path.exists(file_name):
+        with open(file_name) as stream:
+            if marker in stream.read(1024):
+                return False
+
+    import pygal
+
+    config = pygal.Config()
+    config.css.append('http://thisweekinfedora.org/assets/css/svg.css')
+
+    line_chart = pygal.Line(config)
+    lbls = sorted(set(
+        key for activity in evolution for key in evolution[activity]))
+    series = []
+    for activity in sorted(evolution.keys()):
+        # The weeks missing for an activity are left as gaps so that its
+        # values stay aligned with the labels
         values = []
-        for key in sorted(evolution[activity].keys()):
-            val = evolution[activity][key]
-            if val == 0:
+        for key in lbls:
+            val = evolution[activity].get(key)
+            if not val:
                 values.append(val)
             else:
                 values.append(math.log10(val))
-        line_chart.add(activity, values)
-        if not lbls:
-            lbls = sorted(evolution[activity].keys())
-    line_chart.x_labels = lbls
+        series.append((activity, values))
+
+    indices = range(len(lbls))
+    if max_points and len(lbls) > max_points:
+        # The same weeks must be kept for every activity
+        average = []
+        for idx in indices:
+            vals = [serie[idx] for _, serie in series
+                    if serie[idx] is not None]
+            average.append(sum(vals) / float(len(vals)))
+        indices = lttb_indices(average, max_points)
+
+    for activity, values in series:
+        line_chart.add(activity, [values[idx] for idx in indices])
+    line_chart.x_labels = [lbls[idx] for idx in indices]
     line_chart.print_values = False
-    line_chart.render_to_file(os.path.join('themes', 'thisweekinfedora',
-                                           'assets', 'evolution.svg'))
 
+    svg = line_chart.render()
+    if '?>' in svg[:100]:
+        head, tail = svg.split('?>', 1)
+        svg = '{0}?>\n{1}{2}'.format(head, marker, tail)
+    else:
+        svg = '{0}\n{1}'.format(marker, svg)
+    with open(file_name, 'w') as stream:
+        stream.write(svg)
+
+    return True
+
+
+def get_week_bounds(date_to=None):
+    """ Return the datetime objects specifying the end and the start of
+    the week ending the day before the specified date.
+
+    :kwarg date_to: the date of the Monday following the week, defaults
+        to the Monday of the current week.
 
-def process_week(date_to=None):
-    """ Main function.
     """
     if date_to is None:
         date_to = get_week_start()
@@ -335,41 +2989,1004 @@ def process_week(date_to=None):
                            23, 59) - timedelta(days=1)
     datetime_from = datetime(date_to.year, date_to.month, date_to.day,
                              0, 0) - timedelta(days=7)
+    return datetime_to, datetime_from
+
+
+def save_week(datetime_to, stats):
+    """ Store the data retrieved about the week: the activities in the
+    evolution log, the activities per day in the day index and the
+    contributors in the contributors log and the log of the users.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg stats: the data about the week, as returned by
+        `get_fedora_stats`.
+
+    """
+    save_activities(datetime_to, stats['activities'], stats.get('pending'))
+    update_daily_index(stats['daily'])
+    save_contributors(datetime_to, stats['users'])
+    save_user_contributions(datetime_to, stats['users'])
+
+
+def write_week_post(datetime_to, datetime_from):
+    """ Write the blog post of the week from the stored data only.
+
+    The activities come from the evolution log and the top contributors
+    from the contributors log, datagrepper is only queried for the
+    activities of the previous week if they are not stored.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week.
+
+    """
+    evolution = load_evolution()
+    activities = get_week_activities(datetime_to, evolution)
+    if not activities:
+        raise ValueError('No activities stored for the week of {0}'.format(
+            datetime_from))
+    pending = [topic for topic in TOPICS if topic not in activities]
+    day = datetime(datetime_to.year, datetime_to.month, datetime_to.day)
+    top_contributors = get_period_contributors(day, day)
+    previous_activities = get_previous_activities(
+        datetime_to, datetime_from, evolution)
+    create_blog_post(datetime_to, datetime_from, activities,
+                     previous_activities, top_contributors, pending)
+
+
+def stage_week(datetime_to, stats):
+    """ Write the data retrieved about the week in STAGING_DIR, for the
+    `save` command to store it later.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg stats: the data about the week, as returned by
+        `get_fedora_stats`.
+
+    """
+    if not os.path.isdir(STAGING_DIR):
+        os.makedirs(STAGING_DIR)
+    file_name = os.path.join(
+        STAGING_DIR, '{0}.json'.format(datetime_to.strftime('%Y_%m_%d')))
+    with open(file_name, 'w') as stream:
+        stream.write(json.dumps(stats, sort_keys=True))
+    return file_name
+
+
+def load_staged_week(datetime_to):
+    """ Return the data about the week written by `stage_week`.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+
+    """
+    file_name = os.path.join(
+        STAGING_DIR, '{0}.json'.format(datetime_to.strftime('%Y_%m_%d')))
+    with open(file_name) as stream:
+        stats = json.loads(stream.read())
+    # json turned the numbers of contributions into strings
+    for topic, top_users in stats['contributors'].items():
+        stats['contributors'][topic] = dict(
+            (int(count), users) for count, users in top_users.items())
+    return stats
+
+
+def _ingested_file(datetime_to):
+    """ Return the path of the file holding the data of the week ingested
+    day after day.
+    """
+    return os.path.join(
+        STAGING_DIR, '{0}.days.json'.format(datetime_to.strftime('%Y_%m_%d')))
+
+
+def load_ingested_days(datetime_to):
+    """ Return the data of the week ingested day after day as a dictionary
+    associating to each topic a dictionary giving for each day
+    ('%Y_%m_%d') its number of messages (`total`) and the number of
+    contributions of each user (`users`).
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+
+    """
+    file_name = _ingested_file(datetime_to)
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name) as stream:
+        return json.loads(stream.read())
+
+
+def ingest_day(day=None, topics=None, workers=CONCURRENCY, deadline=None):
+    """ Retrieve the messages of one day and add their counts to the data
+    of its week kept in STAGING_DIR, so that the weekly run only has the
+    last day left to retrieve. The topics already ingested for that day
+    are skipped. Returns the data of the week as `load_ingested_days`.
+
+    :kwarg day: a datetime object specifying the day, defaults to
+        yesterday.
+    :kwarg topics: the list of topics to retrieve, defaults to all of
+        them.
+    :kwarg workers: the number of pages retrieved at the same time.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        the topics not retrieved yet are left for later.
+
+    """
+    # The days are those of datagrepper, in UTC
+    if day is None:
+        day = datetime.utcnow() - timedelta(days=1)
+    day = datetime(day.year, day.month, day.day)
+    next_day = day + timedelta(days=1)
+    if next_day > datetime.utcnow():
+        raise ValueError('The day {0} is not over yet'.format(
+            day.strftime('%Y-%m-%d')))
+    datetime_to, _ = get_week_bounds(next_day + timedelta(
+        days=(7 - next_day.weekday()) % 7))
+    date_str = day.strftime('%Y_%m_%d')
+
+    # The week ends at 23:59 on Sunday, the other days end at midnight.
+    # Each message is only kept by the day its timestamp falls in, as in
+    # the count per day of `_count_messages`, so that the messages at the
+    # bound of two days are counted once.
+    end = min(next_day, datetime_to)
+
+    def _fetch(topic):
+        pages = iter_datagrepper(
+            day, end, TOPICS[topic], workers=workers, deadline=deadline)
+        pages = ([msg for msg in messages
+                  if datetime.utcfromtimestamp(msg['timestamp']).strftime(
+                      '%Y_%m_%d') == date_str]
+                 for messages in pages)
+        shard = None
+        if ARCHIVE_DIR:
+            shard = ArchiveShard(TOPICS[topic], datetime_to, day=date_str)
+        try:
+            total, _, users = _count_messages(
+                topic, [date_str], pages, shard=shard)
+        except Exception:
+            if shard:
+                shard.discard()
+            raise
+        if shard:
+            shard.close()
+        return total, users
+
+    # The week was stored by the weekly run already
+    stored = get_week_activities(datetime_to)
+    topics = [topic for topic in (topics or TOPICS) if topic not in stored]
+    if not topics:
+        return load_ingested_days(datetime_to)
+
+    if not os.path.isdir(STAGING_DIR):
+        os.makedirs(STAGING_DIR)
+    file_name = _ingested_file(datetime_to)
+    with _lock_file(file_name):
+        ingested = load_ingested_days(datetime_to)
+        todo = [topic for topic in sorted(topics)
+                if date_str not in ingested.get(topic, {})]
+        if not todo:
+            return ingested
+
+        print 'Ingest day {0}'.format(date_str)
+        results, _ = _fetch_topics(todo, _fetch, deadline)
+        print '\n'
+        for topic, (total, users) in results.items():
+            ingested.setdefault(topic, {})[date_str] = {
+                'total': total, 'users': users}
+
+        fd, tmp_path = tempfile.mkstemp(dir=STAGING_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as stream:
+            stream.write(json.dumps(ingested, sort_keys=True))
+        os.rename(tmp_path, file_name)
+
+    return ingested
+
+
+def ingest_week(datetime_to, datetime_from, topics=None,
+                workers=CONCURRENCY, deadline=None):
+    """ Retrieve the days of the week not ingested yet and return the data
+    of the week in the format of `get_fedora_stats`, summing the counts
+    of its days. The topics missing some of the days are pending.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week.
+    :kwarg topics: the list of topics to retrieve, defaults to all of
+        them.
+    :kwarg workers: the number of pages retrieved at the same time.
+    :kwarg deadline: the time, as returned by `time.time`, after which
+        the days not retrieved yet are left pending.
+
+    """
+    topics = sorted(topics or TOPICS)
+    days = get_days(datetime_from, datetime_to)
+    ingested = load_ingested_days(datetime_to)
+    for date_str in days:
+        if deadline is not None and time.time() > deadline:
+            break
+        ingested = ingest_day(datetime.strptime(date_str, '%Y_%m_%d'),
+                              topics, workers, deadline)
+
+    stats = {'activities': {}, 'contributors': {}, 'daily': {},
+             'users': {}, 'pending': []}
+    for topic in topics:
+        per_day = ingested.get(topic, {})
+        if [date_str for date_str in days if date_str not in per_day]:
+            stats['pending'].append(topic)
+            continue
+        stats['daily'][topic] = dict(
+            (date_str, per_day[date_str]['total']) for date_str in days)
+        stats['activities'][topic] = sum(stats['daily'][topic].values())
+        # ignore user creation in top users
+        if topic != 'FAS user created':
+            users = {}
+            for date_str in days:
+                for user, count in per_day[date_str]['users'].items():
+                    users[user] = users.get(user, 0) + count
+            stats['contributors'][topic] = get_top_users(users)
+            stats['users'][topic] = users
+    return stats
+
+
+def commit_week(datetime_to, datetime_from, stats, svg=True,
+                evolution=None):
+    """ Store the activities of the week, generate the evolution graph
+    and write the blog post of the week.
+
+    :arg datetime_to: a datetime object specifying the starting date and
+        time of the week.
+    :arg datetime_from: a datetime object specifying the ending date and
+        time of the week.
+    :arg stats: the activities and top contributors of the week, as
+        returned by `get_fedora_stats`.
+    :kwarg svg: a boolean specifying whether to generate the evolution
+        graph.
+    :kwarg evolution: the evolution of the activities over time as
+        returned by `load_evolution`, updated with the activities of the
+        week, loaded from the evolution log after storing them if not
+        specified.
+
+    """
+    activities = dict(stats['activities'])
+    top_contributors = dict(stats['contributors'])
+    pending = stats.get('pending', [])
+
+    with METRICS.stage('save'):
+        save_week(datetime_to, stats)
+        if evolution is None:
+            evolution = load_evolution()
+        else:
+            # As the record appended overrides the ones before it
+            date_str = datetime_to.strftime('%Y_%m_%d')
+            for activity, count in stats['activities'].items():
+                evolution.setdefault(activity, {})[date_str] = count
+
+    # The topics not retrieved this time come from an earlier run
+    stored = get_week_activities(datetime_to, evolution)
+    missing = [topic for topic in TOPICS
+               if topic not in activities and topic in stored]
+    if missing:
+        day = datetime(datetime_to.year, datetime_to.month, datetime_to.day)
+        stored_contributors = get_period_contributors(day, day)
+        for topic in missing:
+            activities[topic] = stored[topic]
+            if topic in stored_contributors:
+                top_contributors[topic] = stored_contributors[topic]
+        pending = [topic for topic in pending if topic not in stored]
+
+    if svg:
+        with METRICS.stage('svg'):
+            generate_svg(evolution)
+
+    with METRICS.stage('previous'):
+        # Out of time, do not query datagrepper for the previous week
+        previous_activities = get_previous_activities(
+            datetime_to, datetime_from, evolution, query=not pending)
+
+    with METRICS.stage('post'):
+        create_blog_post(datetime_to, datetime_from, activities,
+                         previous_activities, top_contributors, pending)
+
+
+def process_week(date_to=None, budget=WEEK_BUDGET):
+    """ Main function.
+
+    When the week is partly stored, only the topics missing are
+    retrieved. When the week was ingested day after day, only the days
+    missing are retrieved. The topics not retrieved within the time
+    budget are left pending in the blog post and in the store, for a
+    later run to retrieve them.
+
+    :kwarg date_to: the date of the Monday following the week, defaults
+        to the Monday of the current week.
+    :kwarg budget: the number of seconds given to retrieve the data, None
+        for no limit.
+
+    """
+    metrics = reset_metrics()
+    deadline = None if budget is None else time.time() + budget
+    datetime_to, datetime_from = get_week_bounds(date_to)
     print 'Process week of {0}'.format(datetime_from)
 
-    activities = get_fedora_activity(datetime_to, datetime_from)
+    stored = get_week_activities(datetime_to)
+    # All the topics if none or all of them are stored
+    topics = [topic for topic in TOPICS if topic not in stored] or None
+    ingested = os.path.exists(_ingested_file(datetime_to))
+
+    try:
+        # The activities are derived from the crawl of the contributors
+        with metrics.stage('fetch'):
+            if ingested:
+                # Only the days not ingested yet are left to retrieve
+                stats = ingest_week(datetime_to, datetime_from,
+                                    topics=topics, deadline=deadline)
+            else:
+                stats = get_fedora_stats(datetime_to, datetime_from,
+                                         topics=topics, deadline=deadline)
+
+        commit_week(datetime_to, datetime_from, stats)
+        if ingested and not stats['pending']:
+            file_name = _ingested_file(datetime_to)
+            with _lock_file(file_name):
+                if ARCHIVE_DIR:
+                    archive_ingested_week(datetime_to, datetime_from,
+                                          load_ingested_days(datetime_to))
+                os.remove(file_name)
+                os.remove('{0}.lock'.format(file_name))
+    finally:
+        metrics.write(METRICS_JSON, METRICS_PROM)
+        metrics.write_profiles()
+
+
+def process_rollup(year, month=None):
+    """ Create the blog post summarizing the activities of a month, or of
+    a year if no month is specified, from the stored data only.
+
+    The activities come from the day index, the top contributors from the
+    summaries of the contributors log of the weeks ending in the period.
+    For the weeks stored before them, the weekly totals of the evolution
+    log and the top contributors listed in the blog posts are used.
+
+    :arg year: the year to summarize.
+    :kwarg month: the month to summarize, the whole year if None.
+
+    """
+    if month is None:
+        period = 'year'
+        datetime_from = datetime(year, 1, 1)
+        datetime_to = datetime(year, 12, 31, 23, 59)
+        previous_from = datetime(year - 1, 1, 1)
+        previous_to = datetime(year - 1, 12, 31, 23, 59)
+        title = 'Activities of {0}'.format(year)
+        slug = 'yearly_{0}'.format(year)
+    else:
+        period = 'month'
+        datetime_from = datetime(year, month, 1)
+        datetime_to = datetime(
+            year, month, calendar.monthrange(year, month)[1], 23, 59)
+        previous_to = datetime_from - timedelta(minutes=1)
+        previous_from = datetime(previous_to.year, previous_to.month, 1)
+        title = 'Activities of {0}'.format(datetime_from.strftime('%B %Y'))
+        slug = 'monthly_{0}'.format(datetime_from.strftime('%Y_%m'))
+
+    print 'Process {0} of {1}'.format(period, datetime_from)
+
+    index = DayIndex.load()
+    evolution = load_evolution()
+    activities = get_period_activities(
+        datetime_from, datetime_to, index, evolution)
+    previous_activities = get_period_activities(
+        previous_from, previous_to, index, evolution)
+    summaries = load_heavy_hitters()
+    top_contributors = get_period_contributors(
+        datetime_from, datetime_to, summaries)
+    approximate = get_approximate_contributors(
+        datetime_from, datetime_to, top_contributors, summaries)
+
+    create_rollup_post(period, datetime_to, datetime_from, title, slug,
+                       activities, previous_activities, top_contributors,
+                       approximate)
+
+
+def _start_backfill_worker(shared):
+    """ Give the process started by `backfill` its own request controller,
+    acquiring the semaphore `shared` by all the processes for each query
+    so that together they send no more than CONCURRENCY of them.
+    """
+    global _CONTROLLER, _CONTROLLER_PID
+    _CONTROLLER = RequestController(shared=shared)
+    _CONTROLLER_PID = os.getpid()
+
+
+def _fetch_week(date_to):
+    """ Retrieve the activities and top contributors of the week ending
+    the day before the specified date, for `backfill`.
+
+    Returns a tuple of the date, the data retrieved as returned by
+    `get_fedora_stats` and the error that prevented retrieving it if any,
+    so that one failed week does not stop the others.
+
+    :arg date_to: the date of the Monday following the week.
+
+    """
+    datetime_to, datetime_from = get_week_bounds(date_to)
+    try:
+        stats = get_fedora_stats(datetime_to, datetime_from)
+    except Exception as err:
+        return date_to, None, '{0}: {1}'.format(
+            err.__class__.__name__, err)
+    return date_to, stats, None
+
+
+def is_week_complete(date_to, evolution):
+    """ Return whether the activities of the week ending the day before
+    the specified date are all stored and its blog post written.
+
+    :arg date_to: the date of the Monday following the week.
+    :arg evolution: a dictionary representing the evolution of the
+        activities over time as returned by `load_evolution`.
+
+    """
+    datetime_to, _ = get_week_bounds(date_to)
+    date_str = datetime_to.strftime('%Y_%m_%d')
+    for topic in TOPICS:
+        if date_str not in evolution.get(topic, {}):
+            return False
+    return os.path.exists(
+        os.path.join('posts', '{0}.txt'.format(date_str)))
+
 
-    top_contributors = get_fedora_contributors(
-        datetime_to, datetime_from)
+def backfill(date_from=datetime(2012, 12, 31), date_to=None, workers=5,
+             checkpoint=BACKFILL_CHECKPOINT):
+    """ Process all the weeks between the two specified Mondays.
 
-    evolution = save_activities(datetime_to, activities)
+    The weeks are retrieved by `workers` processes at the same time while
+    their results are stored, one week after the other in chronological
+    order, by the current process. The processes share the CONCURRENCY
+    queries allowed at the same time, each of them adapting how many it
+    sends to how well datagrepper copes with them. Each week stored is
+    recorded in the checkpoint file so that an interrupted backfill
+    resumes where it stopped, and the weeks already complete are
+    skipped. The evolution graph is generated once at the end.
+
+    Returns the list of the weeks which could not be retrieved.
+
+    :kwarg date_from: the date of the first Monday to process.
+    :kwarg date_to: the date before which to stop, defaults to today.
+    :kwarg workers: the number of weeks retrieved at the same time, at
+        most CONCURRENCY.
+    :kwarg checkpoint: the path of the file recording the weeks done.
+
+    """
+    if date_to is None:
+        date_to = datetime.today()
+
+    done = set(record['week'] for record in _read_records(checkpoint))
+    evolution = load_evolution()
+
+    dates = []
+    date_to_process = date_from
+    while date_to_process < date_to:
+        date_str = date_to_process.strftime('%Y_%m_%d')
+        if date_str not in done \
+                and not is_week_complete(date_to_process, evolution):
+            dates.append(date_to_process)
+        date_to_process = date_to_process + timedelta(days=7)
+
+    print 'Backfill {0} weeks'.format(len(dates))
+
+    failed = []
+    if dates:
+        from multiprocessing import Pool
+        from multiprocessing import Semaphore
+
+        workers = max(1, min(workers, len(dates), CONCURRENCY))
+        shared = Semaphore(CONCURRENCY)
+        pool = Pool(workers, _start_backfill_worker, (shared,))
+        # The queries of the current process for the previous weeks not
+        # stored count as well
+        controller = get_controller()
+        controller.shared = shared
+        try:
+            # imap returns the weeks in order, so the previous week is
+            # always stored before the one following it
+            for date, stats, error in pool.imap(_fetch_week, dates):
+                if error:
+                    print 'Failed to retrieve week of {0}: {1}'.format(
+                        date, error)
+                    failed.append(date)
+                    continue
+                datetime_to, datetime_from = get_week_bounds(date)
+                # The evolution is kept up to date instead of reading the
+                # log again for each week
+                commit_week(datetime_to, datetime_from, stats, svg=False,
+                            evolution=evolution)
+                _append_records(
+                    checkpoint, [{'week': date.strftime('%Y_%m_%d')}])
+        finally:
+            controller.shared = None
+            pool.close()
+            pool.join()
 
     generate_svg(evolution)
 
-    previous_activities = get_fedora_activity(
-        datetime_to - timedelta(days=7),
-        datetime_from - timedelta(days=7)
-    )
+    return failed
 
-    create_blog_post(datetime_to, datetime_from, activities,
-                     previous_activities, top_contributors)
 
+def recompute_weeks(date_from, date_to=None):
+    """ Store again the data of the weeks between the two specified
+    Mondays, and write again their blog posts, computing them from the
+    archived messages instead of querying datagrepper. The evolution
+    graph is generated once at the end.
+
+    Returns the list of the weeks which are not fully archived, and were
+    left as they are.
+
+    :arg date_from: the date of the first Monday to recompute.
+    :kwarg date_to: the date before which to stop, defaults to today.
 
-def generate_history():
-    """ Generate all the dates from December 31 2012 and process each
-    week using multithreading to speed things up a little bit.
     """
-    date_from = datetime(2012, 12, 31)
+    if date_to is None:
+        date_to = datetime.today()
+
+    evolution = load_evolution()
+    missing = []
     date_to_process = date_from
-    dates = []
-    while date_to_process < datetime.today():
-        dates.append(date_to_process)
+    while date_to_process < date_to:
+        datetime_to, datetime_from = get_week_bounds(date_to_process)
+        stats = get_archived_stats(datetime_to, datetime_from)
+        if stats is None:
+            print 'Week of {0} not archived'.format(datetime_from)
+            missing.append(date_to_process)
+        else:
+            print 'Recompute week of {0}'.format(datetime_from)
+            commit_week(datetime_to, datetime_from, stats, svg=False,
+                        evolution=evolution)
         date_to_process = date_to_process + timedelta(days=7)
-    p = Pool(5)
-    p.map(process_week, dates)
+
+    generate_svg(evolution)
+
+    return missing
+
+
+def generate_history():
+    """ Generate all the dates from December 31 2012 and process each
+    week using multiprocessing to speed things up a little bit.
+    """
+    return backfill(datetime(2012, 12, 31))
+
+
+def _regenerate_post(week):
+    """ Write again the blog post of one week from the data given, for
+    `regenerate_posts`. Returns a tuple of the name of the file of the
+    post and whether it was written.
+
+    :arg week: a tuple of the datetime object specifying the starting date
+        and time of the week, its activities, the activities of the week
+        before, its top contributors, None to reuse the ones listed in
+        its current blog post, and the activities still pending.
+
+    """
+    datetime_to, activities, previous_activities, top_contributors, \
+        pending = week
+    file_name = '{0}.txt'.format(datetime_to.strftime('%Y_%m_%d'))
+    if top_contributors is None:
+        path = os.path.join('posts', file_name)
+        if os.path.exists(path):
+            top_contributors = parse_post_contributors(path)
+    datetime_from = datetime(
+        datetime_to.year, datetime_to.month, datetime_to.day) \
+        - timedelta(days=6)
+    written = create_blog_post(datetime_to, datetime_from, activities,
+                               previous_activities, top_contributors or {},
+                               pending)
+    return file_name, written
+
+
+def regenerate_posts(workers=None):
+    """ Write again the blog posts of all the weeks stored, using the
+    stored data only, for instance after a change of their layout.
+
+    The activities come from the evolution log and the top contributors
+    from the contributors log, or from the current blog post for the
+    weeks stored before the contributors were. The activities left
+    pending and not retrieved since stay pending. The posts are written by
+    `workers` processes at the same time, and only the files whose
+    content changes are written. The weeks whose previous week is not
+    stored are skipped, as the differences to the previous week could
+    not be computed again.
+
+    Returns the list of the files written.
+
+    :kwarg workers: the number of processes writing the posts, defaults
+        to the number of CPUs.
+
+    """
+    evolution = load_evolution()
+    summaries = load_heavy_hitters()
+    pending_weeks = load_pending()
+
+    weeks = []
+    for date_str in sorted(set(
+            date_str for activity in evolution
+            for date_str in evolution[activity])):
+        datetime_to = datetime.strptime(date_str, '%Y_%m_%d') \
+            + timedelta(hours=23, minutes=59)
+        previous_activities = get_week_activities(
+            datetime_to - timedelta(days=7), evolution)
+        if not previous_activities:
+            print 'No previous week stored for {0}, skipped'.format(date_str)
+            continue
+        top_contributors = None
+        if date_str in summaries:
+            top_contributors = dict(
+                (topic, get_top_users(summary.counts()))
+                for topic, summary in summaries[date_str].items())
+        activities = get_week_activities(datetime_to, evolution)
+        pending = sorted(topic for topic in pending_weeks.get(date_str, ())
+                         if topic not in activities)
+        weeks.append((datetime_to, activities, previous_activities,
+                      top_contributors, pending))
+
+    if not weeks:
+        return []
+
+    from multiprocessing import Pool
+
+    pool = Pool(workers)
+    try:
+        results = pool.map(_regenerate_post, weeks, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+
+    written = [file_name for file_name, changed in results if changed]
+    print 'Regenerated {0} of {1} posts'.format(len(written), len(weeks))
+    return written
+
+
+def _hash_files(paths):
+    """ Return a dictionary associating to each file found in the
+    specified files and folders the sha1 of its content.
+
+    :arg paths: a list of paths of files and folders.
+
+    """
+    hashes = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(root, name)
+                     for root, _, names in os.walk(path) for name in names]
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            files = []
+        for file_name in files:
+            with open(file_name, 'rb') as stream:
+                hashes[file_name] = hashlib.sha1(stream.read()).hexdigest()
+    return hashes
+
+
+def publish(date_to=None, message='Weekly update', run=True, push=True):
+    """ Run the weekly update and publish it.
+
+    The sources of the site are compared to the content hashes stored in
+    PUBLISH_STATE at the last publication: nikola rebuilds the site, in
+    place, only when some of them changed, and only the files which
+    changed are committed. The build of nikola being incremental, the
+    time taken does not grow with the number of posts.
+
+    Returns the list of the files committed.
+
+    :kwarg date_to: the date of the Monday following the week, defaults
+        to the Monday of the current week.
+    :kwarg message: the message of the commit.
+    :kwarg run: a boolean specifying whether to run the weekly update
+        before publishing.
+    :kwarg push: a boolean specifying whether to pull the changes before
+        the weekly update and to push the commits not pushed yet.
+
+    """
+    if push:
+        subprocess.check_call(['git', 'pull', '--rebase'])
+    if run:
+        process_week(date_to)
+
+    previous = {}
+    if os.path.exists(PUBLISH_STATE):
+        with open(PUBLISH_STATE) as stream:
+            previous = json.loads(stream.read())
+    hashes = _hash_files(
+        SITE_SOURCES + [EVOLUTION_LOG, DAILY_INDEX, CONTRIBUTORS_LOG,
+                        USERS_LOG])
+    changed = sorted(
+        file_name for file_name in set(hashes) | set(previous)
+        if hashes.get(file_name) != previous.get(file_name))
+
+    sources = tuple(os.path.join(path, '') for path in SITE_SOURCES)
+    if [file_name for file_name in changed
+            if file_name in SITE_SOURCES or file_name.startswith(sources)]:
+        subprocess.check_call(['nikola', 'build'])
+    else:
+        print 'Site sources unchanged, not building'
+
+    # Only the files the weekly update writes get committed
+    committed = [
+        file_name for file_name in changed
+        if file_name in hashes and (
+            file_name.startswith(os.path.join('posts', ''))
+            or file_name in [EVOLUTION_SVG, EVOLUTION_LOG, DAILY_INDEX,
+                             CONTRIBUTORS_LOG, USERS_LOG])]
+    if committed:
+        subprocess.check_call(['git', 'add', '--'] + committed)
+    # Without previous state all the files are seen as changed, even the
+    # ones already committed
+    if committed and subprocess.call(
+            ['git', 'diff', '--cached', '--quiet', '--'] + committed):
+        subprocess.check_call(
+            ['git', 'commit', '-m', message, '--'] + committed)
+    else:
+        print 'Nothing to commit'
+
+    with open(PUBLISH_STATE, 'w') as stream:
+        stream.write(json.dumps(hashes, indent=2, sort_keys=True))
+
+    # The commits of an earlier run whose push failed are pushed as well
+    if push and int(subprocess.check_output(
+            ['git', 'rev-list', '--count', '@{upstream}..HEAD'])):
+        subprocess.check_call(['git', 'push'])
+    return committed
+
+
+def _parse_date(value):
+    """ Return the datetime object of a date given as YYYY-MM-DD on the
+    command line.
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError(
+            'Invalid date {0!r}, expected YYYY-MM-DD'.format(value))
+
+
+def main(args=None):
+    """ Command line entry point, running the weekly update if no command
+    is specified.
+
+    :kwarg args: the list of the arguments, defaults to the ones of the
+        command line.
+
+    """
+    import argparse
+
+    global CACHE_DIR, CACHE_REFRESH, ARCHIVE_DIR, PROFILE_DIR
+
+    # The options common to all the commands, parsed on their own first
+    # to find whether a command is given
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not use the cache of the answers of datagrepper')
+    common.add_argument(
+        '--refresh', action='store_true',
+        help='Query datagrepper again even if the answer is in the cache')
+    common.add_argument(
+        '--archive', metavar='DIR',
+        help='Archive the raw messages retrieved in this folder')
+    common.add_argument(
+        '--profile', metavar='DIR',
+        help='Profile each stage of the weekly run and write the profiles '
+        'in this folder')
+
+    parser = argparse.ArgumentParser(
+        description='Generate the posts of This week in Fedora from the '
+        'data of datagrepper.', parents=[common])
+    subparsers = parser.add_subparsers(dest='command')
+
+    date_help = 'The Monday following the week, defaults to this Monday'
+
+    cmd = subparsers.add_parser(
+        'week', help='Run the whole weekly update (the default)')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+    cmd.add_argument(
+        '--budget', type=float, default=WEEK_BUDGET,
+        help='The number of seconds given to retrieve the data, 0 for no '
+        'limit')
+
+    cmd = subparsers.add_parser(
+        'fetch', help='Retrieve the data of the week and stage it for save')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+
+    cmd = subparsers.add_parser(
+        'ingest', help='Retrieve the data of one day of the week in progress')
+    cmd.add_argument(
+        '--date', type=_parse_date,
+        help='The day to retrieve, defaults to yesterday')
+
+    cmd = subparsers.add_parser(
+        'contributors', help='Retrieve and print the top contributors of '
+        'the week')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+
+    cmd = subparsers.add_parser(
+        'save', help='Store the data of the week staged by fetch')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+
+    cmd = subparsers.add_parser(
+        'render-svg', help='Generate the evolution graph from the stored data')
+    cmd.add_argument(
+        '--force', action='store_true',
+        help='Generate the graph even if the data did not change')
+    cmd.add_argument(
+        '--max-points', type=int, default=SVG_MAX_POINTS,
+        help='The maximum number of weeks drawn')
+
+    cmd = subparsers.add_parser(
+        'write-post', help='Write the post of the week from the stored data')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+
+    cmd = subparsers.add_parser(
+        'backfill', help='Process all the weeks of a period')
+    cmd.add_argument(
+        '--from', dest='date_from', type=_parse_date,
+        default=datetime(2012, 12, 31),
+        help='The first Monday to process, defaults to 2012-12-31')
+    cmd.add_argument(
+        '--to', dest='date_to', type=_parse_date,
+        help='The date before which to stop, defaults to today')
+    cmd.add_argument(
+        '--workers', type=int, default=5,
+        help='The number of weeks retrieved at the same time')
+
+    cmd = subparsers.add_parser(
+        'recompute', help='Store again the weeks of a period from the '
+        'archived messages, without querying datagrepper')
+    cmd.add_argument(
+        '--from', dest='date_from', type=_parse_date, required=True,
+        help='The first Monday to recompute')
+    cmd.add_argument(
+        '--to', dest='date_to', type=_parse_date,
+        help='The date before which to stop, defaults to today')
+
+    cmd = subparsers.add_parser(
+        'rollup', help='Write the post of a month or a year from the stored '
+        'data')
+    cmd.add_argument('year', type=int)
+    cmd.add_argument('month', type=int, nargs='?')
+
+    cmd = subparsers.add_parser(
+        'distinct', help='Print the estimated number of distinct users of '
+        'each topic over a period, from the stored data')
+    cmd.add_argument(
+        '--from', dest='date_from', type=_parse_date, required=True,
+        help='The first day of the period')
+    cmd.add_argument(
+        '--to', dest='date_to', type=_parse_date,
+        help='The last day of the period, defaults to today')
+
+    cmd = subparsers.add_parser(
+        'leaderboard', help='Print the most active users of a topic over a '
+        'period, from the stored data')
+    cmd.add_argument('topic', choices=sorted(TOPICS))
+    cmd.add_argument(
+        '--from', dest='date_from', type=_parse_date, required=True,
+        help='The first day of the period')
+    cmd.add_argument(
+        '--to', dest='date_to', type=_parse_date,
+        help='The last day of the period, defaults to today')
+    cmd.add_argument(
+        '--size', type=int, default=10, help='The number of users printed')
+
+    cmd = subparsers.add_parser(
+        'user', help='Print the contributions of a user week after week')
+    cmd.add_argument('user')
+
+    cmd = subparsers.add_parser(
+        'publish', help='Run the weekly update, build the site if needed '
+        'and commit the files which changed')
+    cmd.add_argument('--date', type=_parse_date, help=date_help)
+    cmd.add_argument(
+        '--message', default='Weekly update', help='The message of the '
+        'commit')
+    cmd.add_argument(
+        '--no-run', action='store_true',
+        help='Publish the files as they are, without weekly update')
+    cmd.add_argument(
+        '--no-push', action='store_true',
+        help='Neither pull nor push the changes')
+
+    cmd = subparsers.add_parser(
+        'regenerate', help='Write again the blog posts of all the weeks '
+        'from the stored data')
+    cmd.add_argument(
+        '--workers', type=int,
+        help='The number of processes writing the posts, defaults to the '
+        'number of CPUs')
+
+    subparsers.add_parser(
+        'compact', help='Keep only one record per week in the evolution log')
+
+    if args is None:
+        args = sys.argv[1:]
+    # Python 2 argparse requires a command, the weekly update is the
+    # default one
+    if not common.parse_known_args(args)[1]:
+        args = list(args) + ['week']
+    options = parser.parse_args(args)
+
+    if options.no_cache:
+        CACHE_DIR = None
+    CACHE_REFRESH = options.refresh
+    if options.archive:
+        ARCHIVE_DIR = options.archive
+    if options.profile:
+        PROFILE_DIR = options.profile
+
+    if options.command in ['fetch', 'contributors', 'save', 'write-post']:
+        datetime_to, datetime_from = get_week_bounds(options.date)
+
+    if options.command == 'week':
+        process_week(options.date, options.budget or None)
+    elif options.command == 'fetch':
+        stats = get_fedora_stats(datetime_to, datetime_from)
+        print 'Staged in {0}'.format(stage_week(datetime_to, stats))
+    elif options.command == 'ingest':
+        ingest_day(options.date)
+    elif options.command == 'contributors':
+        print _format_contributors(
+            get_fedora_contributors(datetime_to, datetime_from))
+    elif options.command == 'save':
+        save_week(datetime_to, load_staged_week(datetime_to))
+    elif options.command == 'render-svg':
+        if not generate_svg(max_points=options.max_points,
+                            force=options.force):
+            print 'Evolution graph up to date'
+    elif options.command == 'write-post':
+        write_week_post(datetime_to, datetime_from)
+    elif options.command == 'backfill':
+        failed = backfill(options.date_from, options.date_to,
+                          workers=options.workers)
+        if failed:
+            return 1
+    elif options.command == 'recompute':
+        if not ARCHIVE_DIR:
+            parser.error('recompute needs the archive, see --archive')
+        if recompute_weeks(options.date_from, options.date_to):
+            return 1
+    elif options.command == 'rollup':
+        process_rollup(options.year, options.month)
+    elif options.command == 'distinct':
+        distinct = get_distinct_contributors(
+            options.date_from, options.date_to or datetime.today())
+        for topic in sorted(distinct):
+            print '{0} {1}'.format(
+                topic.ljust(25), str(distinct[topic]).rjust(8))
+    elif options.command == 'leaderboard':
+        leaderboard = get_leaderboard(
+            options.date_from, options.date_to or datetime.today(),
+            options.topic, options.size)
+        for user, count, error in leaderboard:
+            print '{0} {1} (+/- {2})'.format(
+                user.ljust(25), str(count).rjust(8), error)
+    elif options.command == 'user':
+        history = get_user_history(options.user)
+        for topic in sorted(history):
+            for week in sorted(history[topic]):
+                print '{0} {1} {2}'.format(
+                    week, topic.ljust(20), str(history[topic][week]).rjust(8))
+    elif options.command == 'publish':
+        publish(options.date, options.message, run=not options.no_run,
+                push=not options.no_push)
+    elif options.command == 'regenerate':
+        for file_name in regenerate_posts(options.workers):
+            print 'Wrote {0}'.format(file_name)
+    elif options.command == 'compact':
+        compact_evolution()
+    return 0
 
 
 if __name__ == '__main__':
-    #generate_history()
-    #process_week(datetime(2013, 7, 1))  # Date of the Monday
-    process_week()
+    sys.exit(main())